@@ -2,9 +2,15 @@ from __future__ import print_function
 
 import logging
 import argparse
+import collections
+import concurrent.futures
 import math
+import multiprocessing
+import os
+import queue
 import sys
 import time
+import traceback
 import numpy as np
 
 from extensive_form_game import blsp_reader
@@ -18,39 +24,64 @@ from matrix_game import regret as matrix_regret
 from eqm import chambolle_pock as cp
 from eqm import excessive_gap_technique as egt
 from eqm import mirror_prox as mp
+from eqm import optimistic_mirror_descent as omd
 from eqm import regret as eqm_regret
 
 algs = {
-    'CP': lambda args: cp.ChambollePock,
+    'CP': lambda args: cp.chambolle_pock_init(
+        estimate_lipschitz=args.estimate_lipschitz),
+    'PDHG': lambda args: cp.RestartedPrimalDual,
     'EGT': lambda args: egt.excessive_gap_technique_init(
         aggressive_stepsizes=args.aggressive_stepsizes,
         init_gap=init_gap, init_update_x=init_update_x,
         allowed_eps_increase=allowed_eps_increase),
     'MP': lambda args: mp.mirror_prox_init(
-        aggressive_stepsizes=args.aggressive_stepsizes),
+        aggressive_stepsizes=args.aggressive_stepsizes,
+        estimate_lipschitz=args.estimate_lipschitz),
+    'OMD': lambda args: omd.optimistic_mirror_descent_init(
+        eta_scale=args.omd_eta, adaptive=args.omd_adaptive,
+        estimate_lipschitz=args.estimate_lipschitz),
     'HEDGE': lambda args: eqm_regret.regret_minimization_initializer(
         matrix_regret.hedge_initializer(
-            1.0 / math.sqrt(num_iterations))),
+            1.0 / math.sqrt(num_iterations)),
+        batched=args.batched_cfr),
     'RM': lambda args: eqm_regret.regret_minimization_initializer(
-        matrix_regret.regret_matching_initializer()),
+        matrix_regret.regret_matching_initializer(),
+        batched=args.batched_cfr),
     'RM+': lambda args: eqm_regret.regret_minimization_initializer(
         matrix_regret.regret_matching_plus_initializer(),
-        alternate=False, linear_averaging=False),
+        alternate=False, linear_averaging=False, batched=args.batched_cfr),
     'CFR+': lambda args: eqm_regret.regret_minimization_initializer(
         matrix_regret.regret_matching_plus_initializer(),
-        alternate=True, linear_averaging=True, name='CFR+'),
+        alternate=True, linear_averaging=True, name='CFR+',
+        batched=args.batched_cfr),
     'CBA+': lambda args: eqm_regret.regret_minimization_initializer(
         matrix_regret.conic_blackwell_plus_initializer(),
-        alternate=True, linear_averaging=True, name='CBA+'),
+        alternate=True, linear_averaging=True, name='CBA+',
+        batched=args.batched_cfr),
+    'PCFR+': lambda args: eqm_regret.regret_minimization_initializer(
+        matrix_regret.predictive_regret_matching_plus_initializer(),
+        alternate=True, averaging_exponent=2.0, name='PCFR+',
+        batched=args.batched_cfr),
+    'DCFR': lambda args: eqm_regret.discounted_cfr_initializer(
+        alternate=True, name='DCFR', batched=args.batched_cfr),
+    'LCFR': lambda args: eqm_regret.discounted_cfr_initializer(
+        1.0, 1.0, 1.0, alternate=True, name='LCFR',
+        batched=args.batched_cfr),
     'RM+_LINEAR': lambda args: eqm_regret.regret_minimization_initializer(
         matrix_regret.regret_matching_plus_initializer(),
-        alternate=False, linear_averaging=True, name='RM+_LINEAR'),
+        alternate=False, linear_averaging=True, name='RM+_LINEAR',
+        batched=args.batched_cfr),
     'EGT_WARM': lambda args: egt.egt_warm_start_initializer(
         alg=eqm_regret.regret_minimization_initializer(
             matrix_regret.regret_matching_plus_initializer(),
             alternate=True, linear_averaging=True),
         aggressive_stepsizes=args.aggressive_stepsizes),
 }
+# the algorithms that --samples supports: those that RegretMinimization
+# runs, and MP
+sampled_algs = ('HEDGE', 'RM', 'RM+', 'CFR+', 'CBA+', 'PCFR+', 'DCFR', 'LCFR',
+                'RM+_LINEAR', 'MP')
 
 parser = argparse.ArgumentParser()
 # Game params
@@ -101,8 +132,92 @@ parser.add_argument(
     default=False,
     dest='aggressive_stepsizes',
     help='use aggressive stepsizing in EGT and Mirror Prox')
+parser.add_argument(
+    '--estimate_lipschitz',
+    action='store_true',
+    default=False,
+    help='base the fixed step sizes of CP, MP and OMD on an estimate of the\
+            Lipschitz constant instead of the certified bound, which is far\
+            too loose for -w all_one. Larger steps, without a guarantee')
+parser.add_argument(
+    '--batched_cfr',
+    action='store_true',
+    default=False,
+    dest='batched_cfr',
+    help='run CFR-based algorithms with all regrets in a single array,\
+            updating a treeplex level at a time')
+
+parser.add_argument(
+    '--samples',
+    type=int,
+    default=0,
+    help='If > 0, RM-based algorithms and MP use unbiased estimates of the\
+            utility vectors from this many sampled opponent sequences.\
+            The mean estimated variance is reported as an extra column.')
+parser.add_argument(
+    '--seed', type=int, default=None, help='random seed for --samples')
+parser.add_argument(
+    '-j',
+    '--jobs',
+    type=int,
+    default=1,
+    help='Number of worker processes that run the algorithms in parallel.\
+            The output is the same as with one job, except for the times.')
+
+parser.add_argument(
+    '--async_eval',
+    type=int,
+    default=0,
+    help='If > 0, compute eps and profile_val in a background thread while\
+            the algorithm keeps iterating, with at most this many output\
+            points waiting for their results')
+
+# Checkpoint params
+parser.add_argument(
+    '--checkpoint_every',
+    type=int,
+    default=0,
+    help='If > 0, save the state of each algorithm every this many\
+            iterations, and when it stops, to --checkpoint')
+parser.add_argument(
+    '--checkpoint',
+    default='checkpoint_{alg}.npz',
+    help='Checkpoint file; {alg} is replaced by the algorithm name')
+parser.add_argument(
+    '--resume',
+    action='store_true',
+    default=False,
+    help='continue each algorithm from its --checkpoint, if there is one,\
+            up to --num_iterations iterations')
+
+# Validation params
+parser.add_argument(
+    '--validation',
+    default='full',
+    choices=['off', 'sampled', 'full'],
+    help='How often the solvers check that their iterates are behavioral\
+            strategies. sampled runs every --validation_every\'th check.')
+parser.add_argument(
+    '--validation_every',
+    type=int,
+    default=100,
+    help='Sampling interval for --validation sampled')
 
 # DGF params
+parser.add_argument(
+    '--prox',
+    default='entropy',
+    choices=['entropy', 'euclidean'],
+    help='Distance-generating function of the prox steps of EGT, MP, CP,\
+            PDHG and OMD: the dilated entropy or the dilated squared\
+            Euclidean norm')
+parser.add_argument(
+    '--precondition',
+    type=int,
+    default=0,
+    help='Passes of Ruiz equilibration of the payoff matrix, folded into the\
+            prox weights (see ExtensiveFormGame.precondition). Only with -w\
+            all_one. Default: none')
 parser.add_argument(
     '--prox_scalar',
     type=float,
@@ -137,6 +252,20 @@ parser.add_argument(
     help='whether to update initial x during search for initial' +
     'smoothing parameters.')
 
+# OMD-only params
+parser.add_argument(
+    '--omd_eta',
+    type=float,
+    default=1.0,
+    help='step size of OMD, in units of its default 1 / (2L); with\
+            --omd_adaptive the adaptive step sizes start at 4 times it.\
+            Default 1')
+parser.add_argument(
+    '--omd_adaptive',
+    action='store_true',
+    default=False,
+    help='let OMD shrink its step sizes by the errors of its predictions')
+
 # Args to do with output formatting
 parser.add_argument(
     '--num_outputs', type=int, default=10, help='number of epsilon outputs')
@@ -181,8 +310,31 @@ gnuplot_out = open(args.gnuplot, 'wt')
 init_gap = args.init_gap
 init_update_x = args.init_update_x
 allowed_eps_increase = args.allowed_eps_increase
+
+algs_to_run = []
+
+# in the order given, so that the output does not depend on set ordering
+algs_arg = []
+for alg in args.alg.upper().split(','):
+    if alg not in algs:
+        print('Unknown algorithm "%s"' % alg)
+        sys.exit(1)
+    elif alg not in algs_arg:
+        algs_arg.append(alg)
+        algs_to_run += [algs[alg](args)]
+# before any algorithm runs, rather than after the ones before it finished
+if args.samples > 0:
+    unsupported = [alg for alg in algs_arg if alg not in sampled_algs]
+    if unsupported:
+        parser.error('--samples is not supported by %s' %
+                     ', '.join(unsupported))
+    if args.aggressive_stepsizes and 'MP' in algs_arg:
+        parser.error('MP -s checks its step sizes with exact utilities, it '
+                     'is not compatible with --samples')
+
 if to_csv:
-    print('iters,gradients,eps,profile_val,algorithm,time')
+    print('iters,gradients,eps,profile_val,algorithm,time' +
+          (',variance' if args.samples > 0 else ''))
 elif debug:
     logging.getLogger().setLevel(logging.DEBUG)
 else:
@@ -224,15 +376,15 @@ elif '.game' in args.game: # this if condition can be commented in for the libgg
 else:
     assert False, 'unknown game %s' % args.game
 
-algs_to_run = []
-
-algs_arg = set(args.alg.upper().split(','))
-for alg in algs_arg:
-    if alg not in algs:
-        print('Unknown algorithm "%s"' % alg)
-        sys.exit(1)
-    else:
-        algs_to_run += [algs[alg](args)]
+if hasattr(game, 'set_validation'):
+    game.set_validation(args.validation, args.validation_every)
+if hasattr(game, 'set_prox'):
+    game.set_prox(args.prox)
+if args.precondition > 0 and hasattr(game, 'precondition'):
+    try:
+        game.precondition(args.precondition)
+    except ValueError as e:
+        parser.error('--precondition: %s' % e)
 
 alg_names = []
 
@@ -244,72 +396,205 @@ if log_scale:
             np.geomspace(1, num_iterations, num_outputs, dtype=int), 0, 0))
 else:
     print_seq = np.linspace(0, num_iterations, num_outputs, dtype=int)
-for alg_idx, alg in enumerate(algs_to_run):
-    t0 = time.time() # start timer
-    opt = alg(game)
-    total_time = time.time() - t0
-    if not to_csv:
-        print(opt)
-        print('iters\tgrads\teps\t\tprofile_val\ttime')
-    eps_initial = opt.epsilon()
-    profile_val_initial = opt.profile_value()
 
-    alg_names.append(str(opt))
-    gradient_computations = opt.gradient_computations()
 
-    t = 0
-    print('$alg%d << EOD' % (alg_idx), file=gnuplot_out)
-    print(0, 0, eps_initial, file=gnuplot_out)
+def run_algorithm(alg_idx, emit):
+    """Runs algs_to_run[alg_idx] on game and passes its results to emit:
+    ('start', alg_idx, name, eps at iteration 0, or None when resumed
+    after it), one ('row', alg_idx, row) per output, and ('end', alg_idx)."""
+    t0 = time.time() # start timer
+    opt = algs_to_run[alg_idx](game)
+    if args.samples > 0:
+        assert isinstance(opt, (eqm_regret.RegretMinimization, mp.MirrorProx))
+        opt.set_sampling(args.samples, args.seed)
+    total_time = time.time() - t0
+    checkpoint = args.checkpoint.format(alg=algs_arg[alg_idx])
+    iterations = 0
+    if args.resume and os.path.exists(checkpoint):
+        info = opt.load_checkpoint(checkpoint)
+        iterations = info['iterations']
+        total_time = info['time']
+    emit(('start', alg_idx, str(opt),
+          opt.epsilon() if iterations == 0 else None))
+
+    # with --async_eval, a background thread evaluates snapshots of the
+    # profile while the solver continues; pending holds (row, future)
+    # pairs in iteration order
+    evaluator = None
+    if args.async_eval > 0:
+        evaluator = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+    pending = collections.deque()
+    stop = False
 
     for i in range(len(print_seq)):
-        # delta = num_iterations/num_outputs + (i < num_iterations % num_outputs)
-        if i > 0:
-            delta = print_seq[i] - print_seq[i - 1]
-        else:
-            delta = print_seq[0]
-
-        t0 = time.time()
-        opt.iterate(delta)
-        total_time += time.time() - t0
-        eps = opt.epsilon()
-        profile_val = opt.profile_value()
-        iter_str = str(print_seq[i])
-        while len(iter_str) < 8:
-            iter_str = "0" + iter_str
-        if to_csv:
-            print('{iters},{gradients},{eps},{profile_val},{algorithm},{time}'.format(
-                iters=print_seq[i],
-                gradients=opt.gradient_computations(),
-                eps=eps,
-                profile_val=profile_val,
-                algorithm=opt,
-                time=total_time
-            ))
-        elif pretty_print:
-            if False and str(opt) == 'ExcessiveGapTechnique':
-                print(
-                    '{iters}\t{grads}\t{eps:.6f}\t{profile_val:.6f}\t{egv:.6f}'.
-                    format(
-                        iters=print_seq[i],
-                        grads=opt.gradient_computations(),
-                        eps=eps,
-                        profile_val=profile_val,
-                        egv=opt.excessive_gap(), ))
-            else:
-                print('{iters}\t{grads}\t{eps:.6f}\t{profile_val:.6f}\t{time:.6f}'.format(
-                    iters=print_seq[i],
-                    grads=opt.gradient_computations(),
-                    eps=eps,
-                    profile_val=profile_val,
-                    time=total_time
-                ))
-        else:
-            print(print_seq[i], opt.gradient_computations(), eps, profile_val)
-        print(iter_str, opt.gradient_computations(), eps, total_time, file=gnuplot_out)
-        if eps < eps_threshold:
+        # outputs before the resumed iteration were made by the earlier run
+        if print_seq[i] < iterations:
+            continue
+        while iterations < print_seq[i]:
+            delta = print_seq[i] - iterations
+            if args.checkpoint_every > 0:
+                delta = min(delta, args.checkpoint_every -
+                            iterations % args.checkpoint_every)
+
+            t0 = time.time()
+            opt.iterate(delta)
+            total_time += time.time() - t0
+            iterations += delta
+            if args.checkpoint_every > 0 and \
+                    iterations % args.checkpoint_every == 0:
+                opt.save_checkpoint(checkpoint, iterations=iterations,
+                                    time=total_time)
+        variance = opt.utility_variance() if args.samples > 0 else None
+        row = (print_seq[i], opt.gradient_computations(), total_time,
+               variance)
+        if evaluator is None:
+            if report_row(alg_idx, emit, row, opt.evaluate()):
+                break
+            continue
+
+        # the profile is read-only unless the solver passed in its own
+        # array, which it may still modify
+        profile = [x.copy() if x.flags.writeable else x
+                   for x in opt.profile()]
+        pending.append((row, evaluator.submit(game.evaluate, *profile)))
+        while not stop and pending and (len(pending) > args.async_eval or
+                                        pending[0][1].done()):
+            row, evaluation = pending.popleft()
+            stop = report_row(alg_idx, emit, row, evaluation.result())
+        if stop:
             break
 
-    print('EOD', file=gnuplot_out)
+    while not stop and pending:
+        row, evaluation = pending.popleft()
+        stop = report_row(alg_idx, emit, row, evaluation.result())
+    if evaluator is not None:
+        # evaluations after the one that reached eps_threshold are dropped,
+        # like the iterations after it without --async_eval
+        for _, evaluation in pending:
+            evaluation.cancel()
+        evaluator.shutdown()
+
+    if args.checkpoint_every > 0:
+        # so that the run can be extended with --resume
+        opt.save_checkpoint(checkpoint, iterations=iterations,
+                            time=total_time)
+    emit(('end', alg_idx))
+
+
+def report_row(alg_idx, emit, row, evaluation):
+    """Emits the row of an output point, given the evaluation of its
+    profile, and returns whether eps_threshold has been reached."""
+    iters, gradients, total_time, variance = row
+    emit(('row', alg_idx, (iters, gradients, evaluation.epsilon,
+                           evaluation.value, total_time, variance)))
+    return evaluation.epsilon < eps_threshold
+
+
+def report(message):
+    """Writes a result of run_algorithm to the outputs."""
+    kind, alg_idx = message[:2]
+    if kind == 'start':
+        name, eps_initial = message[2:]
+        alg_names.append(name)
+        if not to_csv:
+            print(name)
+            print('iters\tgrads\teps\t\tprofile_val\ttime' +
+                  ('\tvariance' if args.samples > 0 else ''))
+        print('$alg%d << EOD' % (alg_idx), file=gnuplot_out)
+        if eps_initial is not None:
+            print(0, 0, eps_initial, file=gnuplot_out)
+        return
+    if kind == 'end':
+        print('EOD', file=gnuplot_out)
+        return
+
+    iters, gradients, eps, profile_val, total_time, variance = message[2]
+    iter_str = str(iters)
+    while len(iter_str) < 8:
+        iter_str = "0" + iter_str
+    if variance is None:
+        variance = ''
+    else:
+        variance = (',' if to_csv else '\t') + str(variance)
+    if to_csv:
+        print('{iters},{gradients},{eps},{profile_val},{algorithm},{time}'.format(
+            iters=iters,
+            gradients=gradients,
+            eps=eps,
+            profile_val=profile_val,
+            algorithm=alg_names[alg_idx],
+            time=total_time
+        ) + variance)
+    elif pretty_print:
+        print('{iters}\t{grads}\t{eps:.6f}\t{profile_val:.6f}\t{time:.6f}'.format(
+            iters=iters,
+            grads=gradients,
+            eps=eps,
+            profile_val=profile_val,
+            time=total_time
+        ) + variance)
+    else:
+        print(iters, gradients, eps, profile_val)
+    print(iter_str, gradients, eps, total_time, file=gnuplot_out)
+
+
+def run_worker(alg_idx):
+    try:
+        run_algorithm(alg_idx, worker_results.put)
+    except Exception:
+        worker_results.put(('error', alg_idx, traceback.format_exc()))
+
+
+if args.jobs > 1 and len(algs_to_run) > 1:
+    # The workers are forked after the game is built, so they share its
+    # (read-only) payoff and reach arrays with this process instead of
+    # rebuilding or unpickling them.
+    # One process per algorithm, at most args.jobs at a time, rather than a
+    # Pool: a pool never finishes the task of a worker that was killed (by
+    # the OOM killer, say), while a killed process has an exit code.
+    context = multiprocessing.get_context('fork')
+    worker_results = context.Queue()
+    # the workers would flush anything still buffered again when they exit
+    sys.stdout.flush()
+    workers = []
+
+    def stop_workers(error):
+        for worker in workers:
+            worker.terminate()
+        print(error)
+        sys.exit(1)
+
+    # results arrive interleaved; report them one algorithm at a time, in
+    # the order of algs_to_run
+    pending = [collections.deque() for _ in algs_to_run]
+    next_alg = 0
+    while next_alg < len(algs_to_run):
+        while len(workers) < len(algs_to_run) and \
+                sum(worker.is_alive() for worker in workers) < args.jobs:
+            workers.append(context.Process(target=run_worker,
+                                           args=(len(workers),)))
+            workers[-1].start()
+        try:
+            message = worker_results.get(timeout=0.1)
+        except queue.Empty:
+            for alg_idx, worker in enumerate(workers):
+                if worker.exitcode not in (None, 0):
+                    stop_workers('%s exited with code %d' %
+                                 (algs_arg[alg_idx], worker.exitcode))
+            continue
+        if message[0] == 'error':
+            stop_workers(message[2])
+        pending[message[1]].append(message)
+        while next_alg < len(algs_to_run) and pending[next_alg]:
+            message = pending[next_alg].popleft()
+            report(message)
+            if message[0] == 'end':
+                next_alg += 1
+    for worker in workers:
+        worker.join()
+else:
+    for alg_idx in range(len(algs_to_run)):
+        run_algorithm(alg_idx, report)
 
 print("""
 set terminal png
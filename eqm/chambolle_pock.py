@@ -1,38 +1,227 @@
 import numpy as np
 
-from .eqm import EquilibriumAlgorithm
+from .eqm import EquilibriumAlgorithm, SequenceFormStrategy
 
 class ChambollePock(EquilibriumAlgorithm):
-    def __init__(self, game, prox_x=None, prox_y=None, L=1.0):
+    _checkpoint_attributes = ('_c_x', '_p_x', '_c_y', '_w', '_u_cy')
+
+    def __init__(self, game, prox_x=None, prox_y=None, L=None,
+                 estimate_lipschitz=False):
+        """L defaults to the certified Lipschitz bound of the utility
+        vectors, or with estimate_lipschitz to the estimate (see
+        EquilibriumAlgorithm._lipschitz_constant)."""
         EquilibriumAlgorithm.__init__(self, game)
 
         self._prox_x = prox_x if prox_x is not None else game.domain(0).prox()
         self._prox_y = prox_y if prox_y is not None else game.domain(1).prox()
 
-        self._x = self._prox_x.center()
-        self._y = self._prox_y.center()
-
-        self._c_x = np.copy(self._x)
-        self._p_x = np.copy(self._x)
-        self._c_y = np.copy(self._y)
+        self._c_x = self._prox_x.center()
+        self._p_x = np.copy(self._c_x)
+        self._c_y = self._prox_y.center()
+        self._set_strategy(0, self._c_x)
+        self._set_strategy(1, self._c_y)
 
         self._w = 1.0
-        self._L = L
+        self._L = L if L is not None else self._lipschitz_constant(
+            self._prox_x, self._prox_y, estimate_lipschitz)
+        # utility of y against c_x; in the next iteration c_x is p_x, so
+        # each iteration computes two utility vectors instead of three
+        self._u_cy = game.utility_for(1, self._c_x)
+        self._u_py = np.zeros(game.domain(1).dimension())
+        self._gradient_computations += 1
 
     def iterate(self, num_iterations=1):
         for t in range(num_iterations):
-            u_py = self._game.utility_for(1, self._p_x)
-            u_cy = self._game.utility_for(1, self._c_x)
-            _, self._c_y = self._prox_y(-1.0, 2*u_cy - u_py, self._L, self._c_y)
+            self._u_py, self._u_cy = self._u_cy, self._u_py
+            u_py = self._u_py
+            u_cy = self._game.utility_for(1, self._c_x, out=self._u_cy,
+                                          workspace=self._workspaces[0])
+            extrapolated = self._utilities[1]
+            np.multiply(u_cy, 2, out=extrapolated)
+            extrapolated -= u_py
+            _, self._c_y = self._prox_y(-1.0, extrapolated, self._L, self._c_y)
 
-            u_x = self._game.utility_for(0, self._c_y)
+            u_x = self._utility_for(0, self._c_y)
             _, c_x = self._prox_x(-1.0, u_x, self._L, self._c_x)
 
             self._p_x = self._c_x
             self._c_x = c_x
-            
+
             alpha = 1.0/(1.0 + self._w); self._w += 1.0
-            self._x = self._game.domain(0).combine(self._x, alpha, self._c_x)
-            self._y = self._game.domain(1).combine(self._y, alpha, self._c_y)
+            self._average_strategy(0, alpha, self._c_x)
+            self._average_strategy(1, alpha, self._c_y)
+
+            self._gradient_computations += 2
+
+
+
+def chambolle_pock_init(**kwargs):
+    def init(game):
+        return ChambollePock(game, **kwargs)
+
+    return init
+
+class RestartedPrimalDual(EquilibriumAlgorithm):
+    """Restarted primal-dual hybrid gradient (Applegate et al., "Practical
+    large-scale linear programming using primal-dual hybrid gradient").
+
+    Each iteration is a Chambolle-Pock step with the same step size eta
+    for both players,
+
+        x' = prox_x(x, eta * u_x(y)),  y' = prox_y(y, eta * u_y(2x' - x)),
+
+    where u_y(2x' - x) = 2 u_y(x') - u_y(x) and u_x(y') is used by the
+    next iteration, so an iteration computes two utility vectors.
+
+    eta adapts to the local curvature of the payoff matrix: a step is
+    accepted when eta |dx^T A dy| <= D_x(x', x) + D_y(y', y), with dx and
+    dy in sequence form and D the Bregman divergences of the proxes, and
+    otherwise retried with a smaller eta. The profile is the average
+    of the iterates since the last restart, weighted by eta.
+
+    Every restart_check iterations the current iterate and the average
+    are compared by their duality gap, and the smaller one is the restart
+    candidate. The paper's normalized duality gap divides by the radius of
+    a ball around the candidate. The treeplexes are bounded, so a ball
+    that covers them has the same radius for every candidate, and plain
+    duality gaps give the same decisions.
+    The algorithm restarts from the candidate when its gap
+        - dropped below sufficient_decay times the gap at the last
+          restart,
+        - dropped below necessary_decay times that gap, but grew since
+          the previous check, or
+        - the iterations since the last restart are more than
+          artificial_restart times all iterations.
+    """
+    _checkpoint_attributes = (
+        '_c_x', '_c_y', '_seq_x', '_seq_y', '_u_x', '_u_y', '_avg_x',
+        '_avg_y', '_w', '_eta', '_attempts', '_iterations',
+        '_restart_iteration', '_restart_gap', '_candidate_gap')
+
+    def __init__(self, game, prox_x=None, prox_y=None, eta=None,
+                 restart_check=64, sufficient_decay=0.2, necessary_decay=0.8,
+                 artificial_restart=0.36):
+        EquilibriumAlgorithm.__init__(self, game)
+
+        self._prox_x = prox_x if prox_x is not None else game.domain(0).prox()
+        self._prox_y = prox_y if prox_y is not None else game.domain(1).prox()
+        self._restart_check = restart_check
+        self._sufficient_decay = sufficient_decay
+        self._necessary_decay = necessary_decay
+        self._artificial_restart = artificial_restart
+
+        self._c_x = self._prox_x.center()
+        self._c_y = self._prox_y.center()
+        self._seq_x = game.domain(0).sequence_form(self._c_x)
+        self._seq_y = game.domain(1).sequence_form(self._c_y)
+        self._u_x = game.utility_for_sequence_form(0, self._seq_y)
+        self._u_y = game.utility_for_sequence_form(1, self._seq_x)
+        self._gradient_computations += 2
+        self._restart_average()
+
+        # an estimate of 1 / ||A||, which the first steps correct
+        self._eta = eta if eta is not None else 1.0 / self._lipschitz_estimate()
+        self._attempts = 0
+        self._iterations = 0
+        self._restart_iteration = 0
+        self._restart_gap = self._gap(self._u_x, self._u_y)
+        self._candidate_gap = np.inf
+
+    def iterate(self, num_iterations=1):
+        for t in range(num_iterations):
+            eta = self._step()
+            self._iterations += 1
+
+            self._w += eta
+            alpha = eta / self._w
+            for avg, seq in ((self._avg_x, self._seq_x),
+                             (self._avg_y, self._seq_y)):
+                avg *= 1.0 - alpha
+                avg += alpha * seq
+            self._update_profile()
+
+            if self._iterations % self._restart_check == 0:
+                self._check_restart()
+
+    def _step(self):
+        """Takes one accepted step and returns its eta."""
+        u_extrapolated = self._utilities[1]
+        while True:
+            eta = self._eta
+            _, x = self._prox_x(-eta, self._u_x, 1.0, self._c_x)
+            seq_x = self._game.domain(0).sequence_form(x)
+            u_y = self._game.utility_for_sequence_form(1, seq_x)
+            np.multiply(u_y, 2, out=u_extrapolated)
+            u_extrapolated -= self._u_y
+            _, y = self._prox_y(-eta, u_extrapolated, 1.0, self._c_y)
+            seq_y = self._game.domain(1).sequence_form(y)
+            u_x = self._game.utility_for_sequence_form(0, seq_y)
+            self._gradient_computations += 2
+
+            dx = seq_x - self._seq_x
+            interaction = abs(np.dot(dx, u_x - self._u_x))
+            divergence = (
+                self._prox_x.bregman_divergence(x, self._c_x, seq_x) +
+                self._prox_y.bregman_divergence(y, self._c_y, seq_y))
+            self._attempts += 1
+            if not divergence > 0 or interaction == 0:
+                # the step moves less than rounding errors and cannot be
+                # judged
+                break
+            limit = divergence / interaction
+            k = self._attempts + 1
+            self._eta = min((1 - k**-0.3) * limit, (1 + k**-0.6) * eta)
+            if eta <= limit:
+                break
+
+        self._c_x, self._seq_x, self._u_y = x, seq_x, u_y
+        self._c_y, self._seq_y, self._u_x = y, seq_y, u_x
+        return eta
+
+    def _gap(self, u_x, u_y):
+        br_x, _ = self._game.domain(0).support(u_x, compute_response=False)
+        br_y, _ = self._game.domain(1).support(u_y, compute_response=False)
+        return br_x + br_y
+
+    def _check_restart(self):
+        u_x = self._game.utility_for_sequence_form(0, self._avg_y)
+        u_y = self._game.utility_for_sequence_form(1, self._avg_x)
+        self._gradient_computations += 2
+        average_gap = self._gap(u_x, u_y)
+        current_gap = self._gap(self._u_x, self._u_y)
+        gap = min(average_gap, current_gap)
+
+        restart = (
+            gap <= self._sufficient_decay * self._restart_gap or
+            (gap <= self._necessary_decay * self._restart_gap and
+             gap > self._candidate_gap) or
+            self._iterations - self._restart_iteration >=
+            self._artificial_restart * self._iterations)
+        if not restart:
+            self._candidate_gap = gap
+            return
+
+        if average_gap < current_gap:
+            self._seq_x, self._seq_y = self._avg_x, self._avg_y
+            self._c_x = self._profile[0].behavioral_form().copy()
+            self._c_y = self._profile[1].behavioral_form().copy()
+            self._u_x, self._u_y = u_x, u_y
+        self._restart_average()
+        self._restart_iteration = self._iterations
+        self._restart_gap = gap
+        self._candidate_gap = np.inf
+
+    def _restart_average(self):
+        self._avg_x = self._seq_x.copy()
+        self._avg_y = self._seq_y.copy()
+        self._w = 0.0
+        self._update_profile()
+
+    def _update_profile(self):
+        for player, avg in enumerate((self._avg_x, self._avg_y)):
+            self._profile[player] = SequenceFormStrategy(
+                self._game.domain(player), avg)
 
-            self._gradient_computations += 3
+    def _restore_checkpoint(self, state):
+        EquilibriumAlgorithm._restore_checkpoint(self, state)
+        self._update_profile()
@@ -1,21 +1,242 @@
+import json
+import logging
+import os
+import numpy as np
+
+
+_LIPSCHITZ_MARGIN = 1.5
+
+
+class SequenceFormStrategy:
+    """A strategy of one player, stored in sequence form.
+
+    Convex combinations of strategies are linear in sequence form, so
+    solvers can keep averages (and iterates that are averages) this way
+    without a round trip through the behavioral form on every iteration.
+    The behavioral form is computed when first asked for and then cached.
+    combine() returns a new instance; accumulate() updates one in place
+    and is meant for running averages that nothing else refers to.
+
+    Arrays that are never modified, the cached behavioral form and the
+    sequence form of a combination, are made read-only, which lets
+    ExtensiveFormGame cache the vectors it computes from them.
+    """
+
+    def __init__(self, domain, seq, behavioral=None):
+        self._domain = domain
+        self._seq = seq
+        self._behavioral = behavioral
+
+    @classmethod
+    def from_behavioral_form(cls, domain, x):
+        return cls(domain, domain.sequence_form(x), x)
+
+    def sequence_form(self):
+        return self._seq
+
+    def behavioral_form(self):
+        if self._behavioral is None:
+            self._behavioral = _read_only(
+                self._domain.behavioral_form(self._seq))
+        return self._behavioral
+
+    def combine(self, alpha, x):
+        """(1 - alpha)*self + alpha*x, where x is in behavioral form."""
+        return SequenceFormStrategy(
+            self._domain,
+            _read_only(self._domain.combine_sequence_form(self._seq, alpha, x)))
+
+    def accumulate(self, alpha, x, workspace=None):
+        """In-place version of combine()."""
+        if not self._seq.flags.writeable:
+            self._seq = self._seq.copy()
+        self._domain.combine_sequence_form(
+            self._seq, alpha, x, out=self._seq, workspace=workspace)
+        self._behavioral = None
+        return self
+
+
 class EquilibriumAlgorithm:
+    # the attributes besides the profile that save_checkpoint() stores:
+    # arrays and numbers set up in __init__ and updated by iterate()
+    _checkpoint_attributes = ()
+
     def __init__(self, game, name=None):
         self._game = game
-        self._x    = game.domain(0).center()
-        self._y    = game.domain(1).center()
+        self._profile = [None, None]
+        self._set_strategy(0, game.domain(0).center())
+        self._set_strategy(1, game.domain(1).center())
         self._gradient_computations = 0
 
+        # buffers reused across iterations by _utility_for and
+        # _average_strategy, indexed by player
+        self._utilities = [
+            np.zeros(game.domain(player).dimension()) for player in (0, 1)
+        ]
+        self._workspaces = [
+            np.zeros(game.domain(player).dimension()) for player in (0, 1)
+        ]
+
         self._name = name if name is not None else self.__class__.__name__
+        self.set_sampling(None)
+
+    def set_sampling(self, num_samples, seed=None):
+        """Makes the solver work with unbiased estimates of the utility
+        vectors, each from num_samples sampled opponent sequences (see
+        ExtensiveFormGame.sampled_utility_for), or with exact utilities if
+        num_samples is None."""
+        self._num_samples = num_samples
+        self._rng = np.random.default_rng(seed)
+        self._variance_sum = 0.0
+        self._num_estimates = 0
+
+    def utility_variance(self):
+        """Mean estimated variance of the sampled utility vectors so far,
+        summed over their entries; nan without sampling."""
+        if self._num_estimates == 0:
+            return np.nan
+        return self._variance_sum / self._num_estimates
+
+    def _set_strategy(self, player, x):
+        self._profile[player] = SequenceFormStrategy.from_behavioral_form(
+            self._game.domain(player), x)
+
+    def _average_strategy(self, player, alpha, x):
+        self._profile[player].accumulate(
+            alpha, x, workspace=self._workspaces[player])
+
+    def _utility_for(self, player, opponent_strategy):
+        """Utility vector of player against opponent_strategy, which is in
+        behavioral form or a SequenceFormStrategy.
+
+        The result lives in a buffer that the next call for the same player
+        overwrites.
+        """
+        out = self._utilities[player]
+        if self._num_samples is not None:
+            return self._sampled_utility_for(player, opponent_strategy, out)
+        if isinstance(opponent_strategy, SequenceFormStrategy):
+            return self._game.utility_for_sequence_form(
+                player, opponent_strategy.sequence_form(), out=out)
+        return self._game.utility_for(
+            player, opponent_strategy, out=out,
+            workspace=self._workspaces[1 - player])
+
+    def _sampled_utility_for(self, player, opponent_strategy, out):
+        if isinstance(opponent_strategy, SequenceFormStrategy):
+            utility, variance = self._game.sampled_utility_for_sequence_form(
+                player, opponent_strategy.sequence_form(), self._num_samples,
+                rng=self._rng, out=out)
+        else:
+            utility, variance = self._game.sampled_utility_for(
+                player, opponent_strategy, self._num_samples, rng=self._rng,
+                out=out, workspace=self._workspaces[1 - player])
+        self._variance_sum += variance
+        self._num_estimates += 1
+        return utility
+
+    def save_checkpoint(self, path, **info):
+        """Writes the state of the solver to the .npz file path, so that
+        load_checkpoint() can continue the run. info holds numbers to store
+        along with it (e.g. the iteration count), which load_checkpoint()
+        returns. The file is replaced atomically, so a run that is killed
+        while saving keeps its previous checkpoint."""
+        state = self._checkpoint_state()
+        for key, value in info.items():
+            state['info.' + key] = value
+        temporary = path + '.tmp'
+        with open(temporary, 'wb') as f:
+            np.savez(f, **state)
+        os.replace(temporary, path)
+
+    def load_checkpoint(self, path):
+        """Restores a state written by save_checkpoint() and returns its
+        info. The solver has to be set up like the one that saved it, for
+        the same game."""
+        with np.load(path) as checkpoint:
+            state = dict(checkpoint.items())
+        if str(state['name']) != str(self):
+            raise ValueError('%s holds a checkpoint of %s, not of %s' %
+                             (path, state['name'], self))
+        self._restore_checkpoint(state)
+        return {
+            key[len('info.'):]: value.item()
+            for key, value in state.items() if key.startswith('info.')
+        }
+
+    def _checkpoint_state(self):
+        """The state of the solver as a dict of arrays. Subclasses with
+        state that _checkpoint_attributes cannot describe extend this and
+        _restore_checkpoint()."""
+        state = {
+            'name': str(self),
+            'x': self._profile[0].sequence_form(),
+            'y': self._profile[1].sequence_form(),
+            'gradient_computations': self._gradient_computations,
+            'rng': json.dumps(self._rng.bit_generator.state),
+            'variance_sum': self._variance_sum,
+            'num_estimates': self._num_estimates,
+        }
+        for name in self._checkpoint_attributes:
+            state[name] = getattr(self, name)
+        return state
+
+    def _restore_checkpoint(self, state):
+        for player, key in enumerate(('x', 'y')):
+            self._profile[player] = SequenceFormStrategy(
+                self._game.domain(player), np.array(state[key]))
+        self._gradient_computations = state['gradient_computations'].item()
+        self._rng.bit_generator.state = json.loads(str(state['rng']))
+        self._variance_sum = state['variance_sum'].item()
+        self._num_estimates = state['num_estimates'].item()
+        for name in self._checkpoint_attributes:
+            setattr(self, name, _restored(getattr(self, name), state[name]))
+
+    def _lipschitz_estimate(self):
+        """An estimate of the Lipschitz constant of the utility vectors in
+        the local norms of the proxes, for step sizes. operator_norm() is a
+        lower bound, and its weights are exact only at the prox centers, so
+        this keeps a margin of _LIPSCHITZ_MARGIN from it."""
+        return _LIPSCHITZ_MARGIN * self._game.operator_norm('prox')
+
+    def _lipschitz_bound(self, prox_x, prox_y):
+        """An upper bound on the Lipschitz constant of the utility vectors in
+        the norms that prox_x and prox_y are 1-strongly convex in, for step
+        sizes that must be safe: max |A_ij|, the operator norm from l1 to
+        l_inf, over the square root of the product of the moduli of strong
+        convexity of the proxes in the l1 norm. Proxes without a known
+        modulus fall back to _lipschitz_estimate()."""
+        moduli = [prox_x.strong_convexity_modulus(),
+                  prox_y.strong_convexity_modulus()]
+        if None in moduli:
+            logging.warning('no strong convexity modulus of the prox is '
+                            'known, the step size is an estimate')
+            return self._lipschitz_estimate()
+        return self._game.operator_norm('l1') / np.sqrt(moduli[0] * moduli[1])
+
+    def _lipschitz_constant(self, prox_x, prox_y, estimate=False):
+        """The Lipschitz constant of fixed step sizes: _lipschitz_bound(),
+        or _lipschitz_estimate() if estimate is set. The estimate is much
+        smaller for weights other than kroer17, but steps taken with it
+        carry no guarantee."""
+        if estimate:
+            return self._lipschitz_estimate()
+        return self._lipschitz_bound(prox_x, prox_y)
 
     def profile(self):
-        return self._x, self._y
+        return (self._profile[0].behavioral_form(),
+                self._profile[1].behavioral_form())
+
+    def evaluate(self):
+        """The ProfileEvaluation of the current profile: epsilon and the
+        profile value, among others, in one pass."""
+        return self._game.evaluate(*self.profile())
 
     def epsilon(self):
-        eps, _, _, _ = self._game.profile_epsilon(self._x, self._y)
-        return eps
+        return self.evaluate().epsilon
 
     def profile_value(self):
-        val = self._game.profile_value(self._x, self._y)
+        val = self._game.profile_value(*self.profile())
         return val
 
     def iterate(self, num_iterations=1):
@@ -26,3 +247,15 @@ class EquilibriumAlgorithm:
 
     def __repr__(self):
         return self._name
+
+
+def _read_only(array):
+    array.flags.writeable = False
+    return array
+
+
+def _restored(old, value):
+    """value, read from a checkpoint, with the type of old."""
+    if isinstance(old, np.ndarray):
+        return np.array(value, dtype=old.dtype)
+    return type(old)(value.item())
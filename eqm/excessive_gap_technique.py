@@ -5,6 +5,8 @@ from .eqm import EquilibriumAlgorithm
 
 
 class ExcessiveGapTechnique(EquilibriumAlgorithm):
+    _checkpoint_attributes = ('_mu', '_tau', '_w')
+
     def __init__(self,
                  game,
                  prox_x=None,
@@ -37,15 +39,20 @@ class ExcessiveGapTechnique(EquilibriumAlgorithm):
         self._gradient_computations = gradient_computations
         if x is not None and y is not None:
             logging.info('warm-starting EGT')
-            self._x, self._y = x, y
+            self._set_strategy(0, x)
+            self._set_strategy(1, y)
             self._mu = np.array([mu, mu * L])
             self.initial_step()
         elif self._init_gap < 0:
-            L = game.payoff_max_norm()
+            # the excessive gap condition holds once mu_1 * mu_2 >= L^2
+            L = self._lipschitz_estimate()
             self._mu = np.array([L, L])
             self.initial_step()
+            while self.excessive_gap() < 0:
+                self._mu *= 2
+                self.initial_step()
         else:
-            self._x = game.domain(0).prox().center()
+            self._set_strategy(0, game.domain(0).prox().center())
             self.initial_step_search()
 
         assert self.excessive_gap() >= 0
@@ -67,16 +74,19 @@ class ExcessiveGapTechnique(EquilibriumAlgorithm):
                     return
 
                 if not self._init_update_x:
-                    self._x = self._prox_x.center()
+                    self._set_strategy(0, self._prox_x.center())
                 # L = 2.0*L
 
     def initial_step(self):
         try:
-            u_y = self._game.utility_for(1, self._x)
-            _, self._y = self._smooth_br_y(-1.0, u_y, self._mu[1])
+            u_y = self._utility_for(1, self._profile[0])
+            _, y = self._smooth_br_y(-1.0, u_y, self._mu[1])
+            self._set_strategy(1, y)
 
-            u_x = self._game.utility_for(0, self._y)
-            _, self._x = self._prox_x(-1.0, u_x, self._mu[0], self._x)
+            u_x = self._utility_for(0, self._profile[1])
+            _, x = self._prox_x(-1.0, u_x, self._mu[0],
+                                self._profile[0].behavioral_form())
+            self._set_strategy(0, x)
 
         except ValueError:
             pass
@@ -89,78 +99,76 @@ class ExcessiveGapTechnique(EquilibriumAlgorithm):
                 self.excessive_gap(), self._tau)
 
     def get_current_iterate_string(self):
+        x, y = self.profile()
         return np.array_str(
-            self._x, max_line_width=999,
+            x, max_line_width=999,
             suppress_small=True) + '\n' + np.array_str(
-                self._y, max_line_width=999, suppress_small=True)
+                y, max_line_width=999, suppress_small=True)
 
     def iterate(self, num_iterations=1):
         for _ in range(num_iterations):
-            old_x = np.copy(self._x)
-            old_y = np.copy(self._y)
+            # the strategies are never modified in place, so this is a
+            # snapshot of the current iterate
+            old_profile = list(self._profile)
             old_mu = np.copy(self._mu)
-            self.shrink(self._tau, old_x, old_y)
+            self.shrink(self._tau, old_profile)
             logging.debug(self.get_params_string())
             if self._aggressive_stepsizes:
                 self._gradient_computations += 2
                 while self.excessive_gap() < 0 or self.worse_than_old(
-                        old_x, old_y, self._x, self._y):
+                        old_profile):
                     self._gradient_computations += 2
                     self._mu = np.copy(old_mu)
                     self._tau *= 0.5
                     logging.getLogger().debug('%s, decreasing stepsize',
                                               self.get_params_string())
-                    self.shrink(self._tau, old_x, old_y)
+                    self.shrink(self._tau, old_profile)
                 if self._tau < 0.5:
                     self._tau *= 1.11
             else:
                 self._tau = 2.0 / (self._w + 3)
             self._w += 1
 
-    def worse_than_old(self, old_x, old_y, new_x, new_y):
+    def worse_than_old(self, old_profile):
         if self._allowed_eps_increase <= 1.0:
             return False
-        old_eps, _, _, _ = self._game.profile_epsilon(old_x, old_y)
-        new_eps, _, _, _ = self._game.profile_epsilon(new_x, new_y)
+        old_eps, _, _, _ = self._game.profile_epsilon(
+            old_profile[0].behavioral_form(), old_profile[1].behavioral_form())
+        new_eps, _, _, _ = self._game.profile_epsilon(*self.profile())
         return new_eps > old_eps * self._allowed_eps_increase
 
-    def shrink(self, tau, x, y):
+    def shrink(self, tau, profile):
         # uncomment this line and comment the following line to do
         # traditional EGT rather than mu balancing.
         # if self._w % 2 == 1:  # shrink mu[0]
         if self._mu[0] > self._mu[1]:  # shrink mu[0]
-            self._shrink_player(tau, x, y, 0, self._prox_x,
+            self._shrink_player(tau, profile, 0, self._prox_x,
                                 self._smooth_br_x, self._smooth_br_y)
         else:
-            self._shrink_player(tau, y, x, 1, self._prox_y,
+            self._shrink_player(tau, profile, 1, self._prox_y,
                                 self._smooth_br_y, self._smooth_br_x)
 
-    def _shrink_player(self, tau, x, y, player, prox_x, smooth_br_x,
+    def _shrink_player(self, tau, profile, player, prox_x, smooth_br_x,
                        smooth_br_y):
         opponent = 1 - player
+        x, y = profile[player], profile[opponent]
         np.set_printoptions(precision=6)
         np.set_printoptions(suppress=True)
         # This gradient could be reused from last iteration's excessive gap
         # check
-        u_x = self._game.utility_for(player, y)
+        u_x = self._utility_for(player, y)
         _, br_x = smooth_br_x(-1.0, u_x, self._mu[player])
-        assert self._game.domain(player).is_behavioral_form(br_x)
-        hat_x = self._game.domain(player).combine(x, tau, br_x)
+        assert self._game.domain(player).validate_behavioral_form(br_x)
+        hat_x = x.combine(tau, br_x)
 
-        u_y = self._game.utility_for(opponent, hat_x)
+        u_y = self._utility_for(opponent, hat_x)
         _, br_y = smooth_br_y(-1.0, u_y, self._mu[opponent])
-        if player == 0:
-            self._y = self._game.domain(opponent).combine(y, tau, br_y)
-        else:
-            self._x = self._game.domain(opponent).combine(y, tau, br_y)
+        self._profile[opponent] = y.combine(tau, br_y)
 
-        u_x = self._game.utility_for(player, br_y)
-        assert self._game.domain(player).is_behavioral_form(br_x)
+        u_x = self._utility_for(player, br_y)
+        assert self._game.domain(player).validate_behavioral_form(br_x)
         _, br_x = prox_x(-tau, u_x, (1 - tau) * self._mu[player], br_x)
-        if player == 0:
-            self._x = self._game.domain(player).combine(x, tau, br_x)
-        else:
-            self._y = self._game.domain(player).combine(x, tau, br_x)
+        self._profile[player] = x.combine(tau, br_x)
 
         self._mu[player] = (1 - 1.0 * tau) * self._mu[player]
         if self._aggressive_stepsizes:
@@ -169,10 +177,10 @@ class ExcessiveGapTechnique(EquilibriumAlgorithm):
             self._gradient_computations += 3
 
     def excessive_gap(self):
-        u_y = self._game.utility_for(1, self._x)
+        u_y = self._utility_for(1, self._profile[0])
         val_f = -self._smooth_br_y(-1.0, u_y, self._mu[1])[0]
 
-        u_x = self._game.utility_for(0, self._y)
+        u_x = self._utility_for(0, self._profile[1])
         val_phi = self._smooth_br_x(-1.0, u_x, self._mu[0])[0]
 
         return val_phi - val_f
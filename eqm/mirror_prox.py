@@ -6,23 +6,30 @@ from .eqm import EquilibriumAlgorithm
 
 
 class MirrorProx(EquilibriumAlgorithm):
+    _checkpoint_attributes = ('_c_x', '_c_y', '_gamma', '_w')
+
     def __init__(self,
                  game,
                  prox_x=None,
                  prox_y=None,
                  num_fixed_point_iterations=2,
-                 aggressive_stepsizes=True):
+                 aggressive_stepsizes=True,
+                 num_samples=None,
+                 seed=None,
+                 estimate_lipschitz=False):
         EquilibriumAlgorithm.__init__(self, game, name="MirrorProx(AS)"
                                       if aggressive_stepsizes else "MirrorProx")
+        self._aggressive_stepsizes = aggressive_stepsizes
+        if num_samples is not None:
+            self.set_sampling(num_samples, seed)
 
         self._prox_x = prox_x if prox_x is not None else game.domain(0).prox()
         self._prox_y = prox_y if prox_y is not None else game.domain(1).prox()
 
-        self._x = self._prox_x.center()
-        self._y = self._prox_y.center()
-
-        self._c_x = np.copy(self._x)
-        self._c_y = np.copy(self._y)
+        self._c_x = self._prox_x.center()
+        self._c_y = self._prox_y.center()
+        self._set_strategy(0, self._c_x)
+        self._set_strategy(1, self._c_y)
 
         # According to Nemirovski04, we can set parameters optimally as
         # M_kl = L_kl * sqrt(Omega_k * Omega_l / sigma_k * sigma_l)
@@ -38,13 +45,23 @@ class MirrorProx(EquilibriumAlgorithm):
             [0.5 / game.domain(0).diameter(), 0.5 / game.domain(1).diameter()])
 
         # With the above setup, the Lipschitz constant is
-        # L = 2 |A|_max * sqrt(diameter_1 * diameter_2)
-        self._gamma_safe = 0.5 / (game.payoff_max_norm() *
-                                  np.sqrt(game.domain(0).diameter() * game.domain(1).diameter()))
+        # L = 2 |A| * sqrt(diameter_1 * diameter_2), where |A| is the
+        # operator norm in the norms the proxes are 1-strongly convex in.
+        # The certified bound makes gamma_safe safe; with estimate_lipschitz
+        # it is only an estimate (see _lipschitz_constant)
+        self._gamma_safe = 0.5 / (
+            self._lipschitz_constant(self._prox_x, self._prox_y,
+                                     estimate_lipschitz) *
+            np.sqrt(game.domain(0).diameter() * game.domain(1).diameter()))
         self._gamma = 1.0 * self._gamma_safe
         self._w = 0.0
 
-        self._aggressive_stepsizes = aggressive_stepsizes
+    def set_sampling(self, num_samples, seed=None):
+        # the step size search checks its condition with exact utilities
+        if num_samples is not None and self._aggressive_stepsizes:
+            raise ValueError('aggressive step sizes need exact utilities, '
+                             'they cannot be combined with sampling')
+        EquilibriumAlgorithm.set_sampling(self, num_samples, seed)
 
     def iterate(self, num_iterations=2):
         for _ in range(num_iterations):
@@ -65,8 +82,8 @@ class MirrorProx(EquilibriumAlgorithm):
                 self._gamma = max(self._gamma_safe, self._gamma / 2.0)
             cur_w_x = next_w_x
             cur_w_y = next_w_y
-            u_x = self._game.utility_for(0, cur_w_y)
-            u_y = self._game.utility_for(1, cur_w_x)
+            u_x = self._utility_for(0, cur_w_y)
+            u_y = self._utility_for(1, cur_w_x)
 
             _, next_w_x = self._prox_x(-self._gamma, u_x,
                                        self._prox_weights[0], self._c_x)
@@ -76,17 +93,14 @@ class MirrorProx(EquilibriumAlgorithm):
             self._gradient_computations += 2
             fixed_point_iters += 1
             print("Fixed-point iters: %s" % fixed_point_iters)
-            self.stepsize_condition_violated(self._gamma, next_w_x, next_w_y,
-                                             cur_w_x, cur_w_y, self._c_x,
-                                             self._c_y)
 
         self._c_x = next_w_x
         self._c_y = next_w_y
 
         self._w += self._gamma
         gamma = self._gamma / self._w
-        self._x = self._game.domain(0).combine(self._x, gamma, self._c_x)
-        self._y = self._game.domain(1).combine(self._y, gamma, self._c_y)
+        self._average_strategy(0, gamma, self._c_x)
+        self._average_strategy(1, gamma, self._c_y)
 
         # if we only needed two fixed point iters then we can be more aggressive
         if self._aggressive_stepsizes and fixed_point_iters < 3:
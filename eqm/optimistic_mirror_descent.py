@@ -0,0 +1,108 @@
+import numpy as np
+
+from .eqm import EquilibriumAlgorithm
+
+# how many times eta the adaptive step size may grow to
+_ADAPTIVE_GROWTH = 4.0
+
+
+class OptimisticMirrorDescent(EquilibriumAlgorithm):
+    """Optimistic mirror descent on the treeplex, which with the dilated
+    entropy prox is optimistic multiplicative weights (OMWU).
+
+    Both players move simultaneously, predicting that the next utility
+    vector repeats the last change:
+
+        x' = argmin -eta*<2 u_x - u_x_prev, x> + D(x, x_current),
+
+    so each iteration computes one utility vector and one prox per player,
+    half of what a MirrorProx step costs. The profile is the last iterate.
+
+    eta defaults to eta_scale / (2 L), the step size of optimistic methods
+    for L-smooth problems, with the certified Lipschitz bound L, or with
+    estimate_lipschitz the estimate (see
+    EquilibriumAlgorithm._lipschitz_constant).
+
+    With adaptive=True the step of each player is
+
+        1 / sqrt(1 / (_ADAPTIVE_GROWTH * eta)^2 + sum of ||u - u_prev||*^2),
+
+    with the prediction errors so far in the dual of the local norm of the
+    prox at its center, the norm that L is measured in. It starts at
+    _ADAPTIVE_GROWTH times eta and shrinks only as much as the predictions
+    turn out to be wrong.
+    """
+    _checkpoint_attributes = ('_c_x', '_c_y', '_previous_utility_x',
+                              '_previous_utility_y', '_squared_error')
+
+    def __init__(self, game, prox_x=None, prox_y=None, eta=None,
+                 adaptive=False, eta_scale=1.0, estimate_lipschitz=False):
+        EquilibriumAlgorithm.__init__(
+            self, game, name='OMD(adaptive)' if adaptive else 'OMD')
+
+        self._prox_x = prox_x if prox_x is not None else game.domain(0).prox()
+        self._prox_y = prox_y if prox_y is not None else game.domain(1).prox()
+        self._eta = eta if eta is not None else 0.5 * eta_scale / \
+            self._lipschitz_constant(self._prox_x, self._prox_y,
+                                     estimate_lipschitz)
+        self._adaptive = adaptive
+        # per-sequence scale of the dual local norms, 0 at the root
+        # sequences, whose Hessian entries are infinite
+        self._dual_scale = [
+            1.0 / np.sqrt(prox.hessian_diagonal(prox.center()))
+            for prox in (self._prox_x, self._prox_y)
+        ]
+
+        self._c_x = self._prox_x.center()
+        self._c_y = self._prox_y.center()
+        self._set_strategy(0, self._c_x)
+        self._set_strategy(1, self._c_y)
+        # the first step predicts no change
+        self._previous_utility_x = self._utility_for(0, self._profile[1]).copy()
+        self._previous_utility_y = self._utility_for(1, self._profile[0]).copy()
+        self._gradient_computations += 2
+        self._squared_error = np.zeros(2)
+        self._prediction = [
+            np.zeros(game.domain(player).dimension()) for player in (0, 1)
+        ]
+
+    def iterate(self, num_iterations=1):
+        for _ in range(num_iterations):
+            u_x = self._utility_for(0, self._profile[1])
+            u_y = self._utility_for(1, self._profile[0])
+            self._gradient_computations += 2
+
+            eta_x = self._step(0, u_x, self._previous_utility_x)
+            eta_y = self._step(1, u_y, self._previous_utility_y)
+            _, self._c_x = self._prox_x(-eta_x, self._predict(0, u_x),
+                                        1.0, self._c_x)
+            _, self._c_y = self._prox_y(-eta_y, self._predict(1, u_y),
+                                        1.0, self._c_y)
+            np.copyto(self._previous_utility_x, u_x)
+            np.copyto(self._previous_utility_y, u_y)
+
+            self._set_strategy(0, self._c_x)
+            self._set_strategy(1, self._c_y)
+
+    def _step(self, player, utility, previous_utility):
+        if not self._adaptive:
+            return self._eta
+        self._squared_error[player] += np.sum(
+            (self._dual_scale[player] * (utility - previous_utility))**2)
+        return 1.0 / np.sqrt((_ADAPTIVE_GROWTH * self._eta)**-2 +
+                             self._squared_error[player])
+
+    def _predict(self, player, utility):
+        """2*utility - the previous utility of player."""
+        previous = (self._previous_utility_x, self._previous_utility_y)[player]
+        prediction = self._prediction[player]
+        np.multiply(utility, 2, out=prediction)
+        prediction -= previous
+        return prediction
+
+
+def optimistic_mirror_descent_init(**kwargs):
+    def init(game):
+        return OptimisticMirrorDescent(game, **kwargs)
+
+    return init
@@ -2,8 +2,11 @@ import math
 import numpy as np
 
 from .eqm import EquilibriumAlgorithm
+from matrix_game import regret as matrix_regret
 from extensive_form_game.cfr import CounterfactualRegretMinimizer
+from extensive_form_game.cfr import BatchedCounterfactualRegretMinimizer
 from extensive_form_game.treeplex import TreeplexDomain
+from extensive_form_game.treeplex import BatchedTreeplexDomain
 """
 returns the sequence {alpha + beta*sqrt(t) + gamma*t}_{t=1}^\inf
 """
@@ -16,18 +19,40 @@ def step_size_generator(alpha, beta, gamma):
         yield alpha + beta * math.sqrt(t - 1) + gamma * (t - 1)
 
 
+"""
+returns the sequence 0^gamma, 1^gamma, 2^gamma, ..., the averaging weights
+of DCFR
+"""
+
+
+def power_step_size_generator(gamma):
+    t = 0
+    while True:
+        yield float(t)**gamma
+        t += 1
+
+
 class RegretMinimization(EquilibriumAlgorithm):
+    _checkpoint_attributes = ('_alpha', '_weight', '_steps')
+
     def __init__(self,
                  game,
                  rm_x,
                  rm_y=None,
                  alternate=False,
                  step=step_size_generator(1.0, 0.0, 0.0),
-                 name=None):
+                 name=None,
+                 batched=False,
+                 num_samples=None,
+                 seed=None):
         def _init_rm(domain, rm):
             if isinstance(domain, TreeplexDomain):
-                regret_matcher = CounterfactualRegretMinimizer(
-                    domain, rm, name)
+                # a batch of games is only ever processed level by level
+                if batched or isinstance(domain, BatchedTreeplexDomain):
+                    cfr = BatchedCounterfactualRegretMinimizer
+                else:
+                    cfr = CounterfactualRegretMinimizer
+                regret_matcher = cfr(domain, rm, name)
             else:
                 regret_matcher = rm(domain)
             self._name = str(regret_matcher)
@@ -39,44 +64,90 @@ class RegretMinimization(EquilibriumAlgorithm):
         self._alternate = alternate
 
         EquilibriumAlgorithm.__init__(self, game, name=self._name)
+        if num_samples is not None:
+            self.set_sampling(num_samples, seed)
 
         self._step = step
         self._alpha = next(step)
         self._weight = self._alpha
+        # the number of step sizes drawn after the first
+        self._steps = 0
+
+    def _checkpoint_state(self):
+        state = EquilibriumAlgorithm._checkpoint_state(self)
+        for prefix, rm in (('rm_x.', self._rm_x), ('rm_y.', self._rm_y)):
+            if isinstance(rm, (CounterfactualRegretMinimizer,
+                               BatchedCounterfactualRegretMinimizer)):
+                rm_state = rm.checkpoint_state()
+            else:
+                rm_state = matrix_regret.minimizer_state(rm)
+            for name, value in rm_state.items():
+                state[prefix + name] = value
+        return state
+
+    def _restore_checkpoint(self, state):
+        steps = self._steps
+        if state['_steps'] < steps:
+            raise ValueError('cannot rewind the step sizes of %s' % self)
+        EquilibriumAlgorithm._restore_checkpoint(self, state)
+        # step is a generator, so catch it up with the saved run
+        for _ in range(self._steps - steps):
+            next(self._step)
+        for prefix, rm in (('rm_x.', self._rm_x), ('rm_y.', self._rm_y)):
+            rm_state = {
+                key[len(prefix):]: value
+                for key, value in state.items() if key.startswith(prefix)
+            }
+            if isinstance(rm, (CounterfactualRegretMinimizer,
+                               BatchedCounterfactualRegretMinimizer)):
+                rm.restore_checkpoint(rm_state)
+            else:
+                matrix_regret.restore_minimizer_state(rm, rm_state)
 
     def iterate(self, num_iterations=1):
         for t in range(num_iterations):
-            u_x = self._game.utility_for(0, self._rm_y.strategy)
+            u_x = self._utility_for(0, self._rm_y.strategy)
             if not self._alternate:
-                u_y = self._game.utility_for(1, self._rm_x.strategy)
+                u_y = self._utility_for(1, self._rm_x.strategy)
 
             self._gradient_computations += 2
 
             self._rm_x(u_x)
 
             if self._alternate:
-                u_y = self._game.utility_for(1, self._rm_x.strategy)
+                u_y = self._utility_for(1, self._rm_x.strategy)
 
             self._rm_y(u_y)
 
             self._alpha = next(self._step)
+            self._steps += 1
             self._weight += self._alpha
             alpha = self._alpha / self._weight
-            self._x = self._game.domain(0).combine(self._x, alpha,
-                                                   self._rm_x.strategy)
-            self._y = self._game.domain(1).combine(self._y, alpha,
-                                                   self._rm_y.strategy)
+            self._average_strategy(0, alpha, self._rm_x.strategy)
+            self._average_strategy(1, alpha, self._rm_y.strategy)
 
 
 def regret_minimization_initializer(rm_x,
                                     rm_y=None,
                                     linear_averaging=False,
+                                    averaging_exponent=None,
                                     **kwargs):
     def init(game, name=None):
-        if linear_averaging:
+        if averaging_exponent is not None:
+            step = power_step_size_generator(averaging_exponent)
+        elif linear_averaging:
             step = step_size_generator(1.0, 0.0, 1.0)
         else:
             step = step_size_generator(1.0, 0.0, 0.0)
         return RegretMinimization(game, rm_x, rm_y, step=step, **kwargs)
 
     return init
+
+
+def discounted_cfr_initializer(alpha=1.5, beta=0.0, gamma=2.0, **kwargs):
+    """Discounted CFR: regrets discounted by (alpha, beta) and iteration t
+    weighted by t^gamma in the average. The defaults are the DCFR
+    parameters of Brown and Sandholm; (1, 1, 1) is linear CFR."""
+    return regret_minimization_initializer(
+        matrix_regret.discounted_regret_matching_initializer(alpha, beta),
+        averaging_exponent=gamma, **kwargs)
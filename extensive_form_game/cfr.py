@@ -1,4 +1,6 @@
+import numpy as np
 from matrix_game.simplex import SimplexDomain
+from matrix_game.regret import minimizer_state, restore_minimizer_state
 
 
 class CounterfactualRegretMinimizer:
@@ -11,16 +13,54 @@ class CounterfactualRegretMinimizer:
         ]
         self.strategy = domain.center()
         self.name = name
+        index = domain.index()
+        bottom_up = index.bottom_up()
+        self._traversal = list(zip(
+            bottom_up.tolist(), index.begin[bottom_up].tolist(),
+            index.end[bottom_up].tolist(), index.parent[bottom_up].tolist()))
+        self._root = index.root
+        self._predictive = getattr(self.rms[0], 'predictive', False) \
+            if self.rms else False
 
     def __call__(self, utility):
-        for info_set in self.domain.infoset_traversal():
-            begin = self.domain.information_set_first_sequence(info_set)
-            end = self.domain.information_set_last_sequence(info_set)
-            parent = self.domain.information_set_parent_sequence(info_set)
-            ev = self.rms[info_set](utility[begin:end])
-            if parent != self.domain.root_sequence():
+        if self._predictive:
+            # predictive regret minimizers (PCFR+) see the observed utility
+            # with the predicted values of the child information sets
+            prediction = utility.copy()
+        for info_set, begin, end, parent in self._traversal:
+            rm = self.rms[info_set]
+            if self._predictive:
+                ev = rm(utility[begin:end], prediction[begin:end])
+                if parent != self._root:
+                    prediction[parent] += rm.predicted_value
+            else:
+                ev = rm(utility[begin:end])
+            if parent != self._root:
                 utility[parent] += ev
-            self.strategy[begin:end] = self.rms[info_set].strategy
+            self.strategy[begin:end] = rm.strategy
+
+    def checkpoint_state(self):
+        """The state of the regret minimizers as a dict of arrays: each
+        array attribute concatenated over the information sets, and each
+        number as an array with one entry per information set."""
+        states = [minimizer_state(rm) for rm in self.rms]
+        state = {'strategy': self.strategy}
+        for name in states[0] if states else ():
+            state['rms.' + name] = np.concatenate(
+                [np.atleast_1d(rm_state[name]) for rm_state in states])
+        return state
+
+    def restore_checkpoint(self, state):
+        self.strategy[:] = state['strategy']
+        sizes = [rm.strategy.size for rm in self.rms]
+        for name in minimizer_state(self.rms[0]) if self.rms else ():
+            if isinstance(getattr(self.rms[0], name), np.ndarray):
+                values = np.split(state['rms.' + name],
+                                  np.cumsum(sizes)[:-1])
+            else:
+                values = state['rms.' + name]
+            for rm, value in zip(self.rms, values):
+                restore_minimizer_state(rm, {name: value})
 
     def __str__(self):
         assert len(self.rms) > 0
@@ -28,3 +68,79 @@ class CounterfactualRegretMinimizer:
             return 'CFR(%s)' % self.rms[0]
         else:
             return self.name
+
+
+class BatchedCounterfactualRegretMinimizer:
+    """CFR with all regrets in one array, updated a treeplex level at a time.
+
+    Runs the segmented() version of the regret minimizer that
+    initialize_regret_minimizer builds, so the iterates are the same as
+    those of CounterfactualRegretMinimizer. Regrets are stored level by
+    level, deepest level first, so that each level is a contiguous slice.
+    """
+
+    def __init__(self, domain, initialize_regret_minimizer, name=None):
+        self.domain = domain
+        self.rm = initialize_regret_minimizer(SimplexDomain(1)).segmented()
+        self.strategy = domain.center()
+        self.name = name
+        self._levels = list(reversed(domain.index().levels))
+        self._slices = []
+        offset = 0
+        for level in self._levels:
+            self._slices.append(slice(offset, offset + len(level.seqs)))
+            offset += len(level.seqs)
+        self.regret = np.zeros(offset)
+        self._predictive = getattr(self.rm, 'predictive', False)
+        init_state = getattr(self.rm, 'init_state', None)
+        self._states = [() if init_state is None else init_state(level)
+                        for level in self._levels]
+        self._strategy = np.concatenate(
+            [self.strategy[level.seqs] for level in self._levels] +
+            [np.zeros(0)])
+
+    def __call__(self, utility):
+        if self._predictive:
+            prediction = utility.copy()
+        for level, level_slice, state in zip(self._levels, self._slices,
+                                             self._states):
+            strategy = self._strategy[level_slice]
+            if self._predictive:
+                ev = self.rm(self.regret[level_slice], strategy,
+                             utility[level.seqs], level, *state,
+                             prediction=prediction[level.seqs])
+                np.add.at(prediction, level.parents, self.rm.predicted_value)
+            else:
+                ev = self.rm(self.regret[level_slice], strategy,
+                             utility[level.seqs], level, *state)
+            # the root sequence is not an information set's sequence, so
+            # adding the top level's values to it is harmless
+            np.add.at(utility, level.parents, ev)
+            self.strategy[level.seqs] = strategy
+
+    def checkpoint_state(self):
+        """The regrets, strategies and minimizer states as a dict of
+        arrays."""
+        state = {
+            'strategy': self.strategy,
+            'regret': self.regret,
+            'level_strategy': self._strategy,
+        }
+        for level, level_state in enumerate(self._states):
+            for i, array in enumerate(level_state):
+                state['state%d_%d' % (level, i)] = array
+        return state
+
+    def restore_checkpoint(self, state):
+        self.strategy[:] = state['strategy']
+        self.regret[:] = state['regret']
+        self._strategy[:] = state['level_strategy']
+        for level, level_state in enumerate(self._states):
+            for i, array in enumerate(level_state):
+                array[...] = state['state%d_%d' % (level, i)]
+
+    def __str__(self):
+        if self.name is None:
+            return 'CFR(%s)' % self.rm
+        else:
+            return self.name
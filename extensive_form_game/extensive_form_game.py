@@ -1,9 +1,18 @@
 from __future__ import print_function
 import sys
-from collections import defaultdict
+import threading
+from collections import defaultdict, namedtuple, OrderedDict
 import numpy as np
-from scipy.sparse import isspmatrix_lil, isspmatrix_csr
-from .treeplex import TreeplexDomain
+from scipy.sparse import isspmatrix_lil, isspmatrix_csr, block_diag, diags
+try:
+    # a private scipy module, which a release may move or change
+    from scipy.sparse._sparsetools import csr_matvec as _sparsetools_matvec
+except ImportError:
+    _sparsetools_matvec = None
+from matrix_game.game import ProfileEvaluation
+from matrix_game.game import sample_columns, sampled_variance
+from .treeplex import TreeplexDomain, BatchedTreeplexDomain
+from .treeplex import VALIDATION_FULL
 
 
 class ExtensiveFormGame:
@@ -15,6 +24,13 @@ class ExtensiveFormGame:
 
     Expects A and reach to be of type scipy.sparse.lil_matrix or
     scipy.sparse.csr_matrix
+
+    validation controls how often the solvers check that their iterates are
+    behavioral strategies (see TreeplexDomain.set_validation).
+
+    Sequence forms and utility vectors of strategies that cannot change,
+    read-only arrays that own their data, are cached by identity; cache_size
+    bounds the number of cached vectors.
     """
 
     def __init__(self,
@@ -29,59 +45,98 @@ class ExtensiveFormGame:
                  reach=None,
                  all_negative=False,
                  offset=0,
-                 B=None):
+                 B=None,
+                 validation=VALIDATION_FULL,
+                 validation_every=1,
+                 cache_size=16):
         if seq_to_str is None:
             seq_to_str = [defaultdict(), defaultdict()]
-        self._name = name
         assert isspmatrix_lil(A) or isspmatrix_csr(A)
-        if isspmatrix_csr(A):
-            self._A = A
-        else:
-            self._A = A.tocsr()
-        if reach is not None:
-            if isspmatrix_csr(reach[0]):
-                self._reach = reach
-            else:
-                self._reach = (reach[0].tocsr(), reach[1].tocsr())
-        self._A_T = self._A.transpose()
+        if not isspmatrix_csr(A):
+            A = A.tocsr()
+        if reach is not None and not isspmatrix_csr(reach[0]):
+            reach = (reach[0].tocsr(), reach[1].tocsr())
+        if B is not None and not isspmatrix_csr(B):
+            B = B.tocsr()
         # print(A, first, end, parent)
-        self._domains = (TreeplexDomain(
-            self._A.get_shape()[0],
+        domains = (TreeplexDomain(
+            A.get_shape()[0],
             first[0],
             end[0],
             parent[0],
             seq_to_str[0],
             prox_infoset_weights=prox_infoset_weights,
             prox_scalar=prox_scalar), TreeplexDomain(
-                self._A.get_shape()[1],
+                A.get_shape()[1],
                 first[1],
                 end[1],
                 parent[1],
                 seq_to_str[1],
                 prox_infoset_weights=prox_infoset_weights,
                 prox_scalar=prox_scalar))
+        self._init_state(name, A, domains, reach, all_negative, offset, B,
+                         validation, validation_every, cache_size)
+
+    def _init_state(self, name, A, domains, reach, all_negative, offset, B,
+                    validation, validation_every, cache_size):
+        """The state of a game with the CSR payoff matrix A (and B and reach,
+        if not None) and the strategy spaces domains, which
+        BatchedExtensiveFormGame shares."""
+        self._name = name
+        self._A = A
+        self._A_T = self._A.transpose().tocsr()
+        self._reach = reach
+        # squared column norms of each player's payoff matrix, for
+        # sampled_utility_for
+        self._column_norms = [None, None]
+        # operator_norm() by norm and kinds of prox
+        self._operator_norms = {}
+        self._domains = domains
         self.all_negative = all_negative
         self.offset = offset
-        if B is not None:
-            if isspmatrix_csr(B):
-                self._B = B
-            else:
-                self._B = B.tocsr()
-        else:
-            self._B = None
+        self._B = B
+        self.set_validation(validation, validation_every)
+        self._cache = _StrategyCache(cache_size)
 
     def domain(self, player):
         return self._domains[player]
 
+    def set_validation(self, level, every=1):
+        for domain in self._domains:
+            domain.set_validation(level, every)
+
+    def set_prox(self, kind):
+        """Switches the prox of both domains (see TreeplexDomain.set_prox)."""
+        for domain in self._domains:
+            domain.set_prox(kind)
+
+    def cache_info(self):
+        """Hits and misses of the sequence form and utility cache."""
+        return self._cache.info()
+
     def profile_epsilon(self, x, y):
-        value = self.profile_value(x, y)
-        br_x, _ = self.domain(0).support(self.utility_for(0, y))
-        br_y, _ = self.domain(1).support(self.utility_for(1, x))
-        return br_x + br_y, br_x - value, br_y + value, value
+        return self.evaluate(x, y)
+
+    def evaluate(self, x, y):
+        """profile_epsilon() and profile_value() together, from one
+        sequence form and one utility vector per player. Returns a
+        ProfileEvaluation."""
+        seq_x = self._sequence_form(0, x)
+        seq_y = self._sequence_form(1, y)
+        u_x = self.utility_for_sequence_form(0, seq_y)
+        u_y = self.utility_for_sequence_form(1, seq_x)
+        value = self._value(seq_x, u_x)
+        br_x, _ = self.domain(0).support(u_x, compute_response=False)
+        br_y, _ = self.domain(1).support(u_y, compute_response=False)
+        return ProfileEvaluation(br_x + br_y, br_x - value, br_y + value,
+                                 value)
 
     def profile_value(self, x, y):
-        seq = self.domain(0).sequence_form(x)
-        return np.dot(seq, self.utility_for(0, y))
+        seq = self._sequence_form(0, x)
+        return self._value(seq, self.utility_for(0, y))
+
+    def _value(self, seq, utility):
+        return np.dot(seq, utility)
 
     def max_infoset_regret(self, x, y):
         return max(
@@ -90,32 +145,189 @@ class ExtensiveFormGame:
 
     def max_player_infoset_regret(self, player, strategy, opponent_strategy):
         g = self.utility_for(player, opponent_strategy)
-        regrets = self.domain(player).infoset_regrets(g, strategy)
+        regrets, _ = self.domain(player).infoset_regrets(
+            g, strategy, compute_response=False)
         return np.max(regrets * self.reach(player, opponent_strategy))
 
     def sum_of_player_infoset_regret(self, player, strategy,
                                      opponent_strategy):
         g = self.utility_for(player, opponent_strategy)
-        regrets = self.domain(player).infoset_regrets(g, strategy)
+        regrets, _ = self.domain(player).infoset_regrets(
+            g, strategy, compute_response=False)
         return np.sum(regrets * self.reach(player, opponent_strategy))
 
-    def utility_for(self, player, opponent_strategy):
-        seq = self.domain(1 - player).sequence_form(opponent_strategy)
+    def utility_for(self, player, opponent_strategy, out=None, workspace=None):
+        """
+        out receives the utility vector and workspace the sequence form of
+        opponent_strategy; both are allocated if not given.
+        """
+        seq = self._sequence_form(1 - player, opponent_strategy, out=workspace)
+        return self.utility_for_sequence_form(player, seq, out=out)
+
+    def utility_for_sequence_form(self, player, seq, out=None):
+        if _StrategyCache.cacheable(seq):
+            utility = self._cache.get(
+                'utility', player, seq,
+                lambda: self._utility_for_sequence_form(player, seq))
+            if out is None:
+                return utility.copy()
+            np.copyto(out, utility)
+            return out
+        return self._utility_for_sequence_form(player, seq, out)
+
+    def _sequence_form(self, player, x, out=None):
+        """domain(player).sequence_form(x, out). For a cacheable x this is
+        the cached, read-only, array, which is also copied to out."""
+        if not _StrategyCache.cacheable(x):
+            return self.domain(player).sequence_form(x, out=out)
+        seq = self._cache.get('sequence_form', player, x,
+                              lambda: self.domain(player).sequence_form(x))
+        if out is not None:
+            np.copyto(out, seq)
+        return seq
+
+    def _utility_for_sequence_form(self, player, seq, out=None):
         if player == 0:
-            return -self._A.dot(seq)
+            if out is None:
+                return -self._A.dot(seq)
+            return np.negative(_csr_matvec(self._A, seq, out), out=out)
 
         assert player == 1
-        return self._A_T.dot(seq)
+        if out is None:
+            return self._A_T.dot(seq)
+        return _csr_matvec(self._A_T, seq, out)
+
+    def sampled_utility_for(self,
+                            player,
+                            opponent_strategy,
+                            num_samples,
+                            rng=None,
+                            out=None,
+                            workspace=None):
+        """Unbiased estimate of utility_for, for games too large for a full
+        matvec on every iteration.
+
+        Draws num_samples opponent sequences with probability proportional
+        to their sequence-form mass (among sequences with payoff entries)
+        and only touches the nonzeros of those columns. Returns the estimate
+        and an estimate of its variance, summed over the entries.
+        """
+        seq = self.domain(1 - player).sequence_form(
+            opponent_strategy, out=workspace)
+        return self.sampled_utility_for_sequence_form(
+            player, seq, num_samples, rng=rng, out=out)
+
+    def sampled_utility_for_sequence_form(self,
+                                          player,
+                                          seq,
+                                          num_samples,
+                                          rng=None,
+                                          out=None):
+        # the columns of player's payoff matrix are rows of the other one
+        columns_of = self._A_T if player == 0 else self._A
+        if self._column_norms[player] is None:
+            self._column_norms[player] = np.bincount(
+                np.repeat(np.arange(columns_of.shape[0]),
+                          np.diff(columns_of.indptr)),
+                weights=columns_of.data**2, minlength=columns_of.shape[0])
+        weights = np.where(self._column_norms[player] > 0, seq, 0.0)
+        columns, counts, mass = sample_columns(weights, num_samples, rng)
+        estimate = columns_of[columns].T.dot(counts * (mass / num_samples))
+        if player == 0:
+            np.negative(estimate, out=estimate)
+        if out is not None:
+            out[:] = estimate
+            estimate = out
+        return estimate, sampled_variance(estimate, counts, mass,
+                                          self._column_norms[player][columns])
 
     def payoff_max_norm(self):
         return max(self._A.max(), -self._A.min())
 
+    def operator_norm(self, norm='prox'):
+        """max x'Ay over sequence-form directions x and y of norm 1, the
+        Lipschitz constant that step sizes of first-order methods depend on.
+        The root sequences are fixed, so they are left out. norm is
+            'l1': the l1 norm for both players, i.e. the largest |A_ij|;
+            'l2': the Euclidean norm, i.e. the spectral norm of A;
+            'prox': the local norms of the players' proxes at their centers,
+                sqrt(x'Hx) for the diagonal H of the Hessian of the
+                distance-generating function.
+        'l2' and 'prox' are estimated by power iteration, which converges
+        from below. The result is cached for the current proxes:
+        set_prox() and set_prox_weights() of a domain build new ones."""
+        key = (norm, self.domain(0).prox(), self.domain(1).prox())
+        if key not in self._operator_norms:
+            if norm == 'l1':
+                scale = [self._directions(player) for player in (0, 1)]
+                value = np.max(np.abs(
+                    diags(scale[0]).dot(self._A).dot(diags(scale[1])).data),
+                    initial=0.0)
+            else:
+                assert norm in ('l2', 'prox')
+                scale = [self._directions(player, norm == 'prox')
+                         for player in (0, 1)]
+                value = _largest_singular_value(
+                    diags(scale[0]).dot(self._A).dot(diags(scale[1])).tocsr())
+            self._operator_norms[key] = value
+        return self._operator_norms[key]
+
+    def _directions(self, player, prox_weighted=False):
+        """Per-sequence scale of the directions operator_norm() measures:
+        0 at the root sequences, and 1/sqrt(H) with prox_weighted."""
+        domain = self.domain(player)
+        scale = np.ones(domain.dimension())
+        if prox_weighted:
+            prox = domain.prox()
+            scale /= np.sqrt(prox.hessian_diagonal(prox.center()))
+        scale[domain.root_sequence()] = 0.0
+        return scale
+
+    def precondition(self, iterations=10):
+        """Diagonal preconditioning after Ruiz equilibration of the payoff
+        matrix, for games whose payoffs span orders of magnitude.
+
+        Rescaled strategies would break the sequence-form constraints, so
+        the scaling goes into the prox weights instead. Each pass multiplies
+        the weight of every information set by the largest entry of
+        S_x A S_y in the rows of its subtree, where S is the scale of
+        operator_norm('prox'). The iterates, and epsilon, stay those of the
+        original game.
+
+        It is meant for all-one weights, where it speeds up EGT and the
+        fixed step sizes of CP, MP and OMD, but slows down PDHG. The kroer15
+        and kroer17 weights already grow with the subtrees, so they raise
+        ValueError. Solvers pick up the weights when they are constructed;
+        call this after set_prox()."""
+        for player in (0, 1):
+            weighting = self.domain(player).prox_weighting()
+            if weighting in ('kroer15', 'kroer17'):
+                raise ValueError('preconditioning slows the solvers down '
+                                 'with %s weights' % weighting)
+        for _ in range(iterations):
+            scale = [self._directions(player, prox_weighted=True)
+                     for player in (0, 1)]
+            scaled = abs(diags(scale[0]).dot(self._A).dot(diags(scale[1])))
+            maxima = (scaled.max(axis=1).toarray().ravel(),
+                      scaled.max(axis=0).toarray().ravel())
+            for player in (0, 1):
+                domain = self.domain(player)
+                largest = maxima[player].copy()
+                for level in reversed(domain.index().levels):
+                    np.maximum.at(largest, level.parents,
+                                  level.max(largest[level.seqs]))
+                level = domain.index().all_infosets
+                factors = np.ones(domain.num_information_sets())
+                largest = level.max(largest[level.seqs])
+                factors[level.infosets] = np.where(largest > 0, largest, 1.0)
+                domain.set_prox_weights(domain.prox_weights() * factors)
+
     def reach(self, player, opponent_strategy):
         if self._reach is None:
             raise ValueError(
                 "The reach argument in __init__ has to be set in order to call reach()"
             )
-        seq = self.domain(1 - player).sequence_form(opponent_strategy)
+        seq = self._sequence_form(1 - player, opponent_strategy)
         return self._reach[player].dot(seq)
 
     def print_payoff_matrix(self,
@@ -151,3 +363,132 @@ class ExtensiveFormGame:
     def __str__(self):
         return 'ExtensiveFormGame(%s, %dx%d)' % (self._name, self._A.shape[0],
                                                  self._A.shape[1])
+
+
+class BatchedExtensiveFormGame(ExtensiveFormGame):
+    """
+    A batch of games that share their treeplexes and differ in their
+    payoff matrices, e.g. one betting structure on many boards.
+
+    domains are the TreeplexDomains of the two players, e.g. those of an
+    ExtensiveFormGame with the same betting structure, so that they are
+    built once for the whole batch. payoff_matrices holds one A (in the
+    format ExtensiveFormGame expects) per game.
+
+    The strategy spaces are BatchedTreeplexDomains: a strategy, or a
+    utility vector, of the batch is a (K, dimension) array of one row per
+    game, stored row by row. The payoff matrix is the block diagonal matrix
+    of the games' payoff matrices, so utility_for() computes the utilities
+    of all games with a single matvec. profile_epsilon() and profile_value()
+    return one value per game, and so does EquilibriumAlgorithm.epsilon()
+    for a batch. RegretMinimization solves all games of a batch at once,
+    and its iterates are those it computes for each game on its own.
+    """
+
+    def __init__(self,
+                 name,
+                 payoff_matrices,
+                 domains,
+                 validation=VALIDATION_FULL,
+                 validation_every=1,
+                 cache_size=16):
+        self._batch_size = len(payoff_matrices)
+        shape = (domains[0].dimension(), domains[1].dimension())
+        for A in payoff_matrices:
+            assert isspmatrix_lil(A) or isspmatrix_csr(A)
+            assert A.shape == shape
+        self._init_state(
+            name, block_diag(payoff_matrices, format='csr'),
+            tuple(BatchedTreeplexDomain(domain, self._batch_size)
+                  for domain in domains),
+            None, False, 0, None, validation, validation_every, cache_size)
+
+    def batch_size(self):
+        return self._batch_size
+
+    def _value(self, seq, utility):
+        return np.sum(self.domain(0).unstack(seq * utility), axis=1)
+
+    def __str__(self):
+        return 'BatchedExtensiveFormGame(%s, %d x %dx%d)' % (
+            self._name, self._batch_size, self.domain(0).unbatched().
+            dimension(), self.domain(1).unbatched().dimension())
+
+
+CacheInfo = namedtuple('CacheInfo', ['hits', 'misses', 'maxsize', 'currsize'])
+
+
+class _StrategyCache:
+    """A bounded LRU cache of vectors computed from a strategy of a player,
+    keyed by the identity of the strategy.
+
+    Only strategies that cannot change are cached: read-only arrays that own
+    their data (see SequenceFormStrategy). An entry keeps its strategy alive,
+    so that the id is not reused while it is a key. Cached vectors are
+    read-only. The cache may be used from several threads.
+    """
+
+    def __init__(self, size):
+        self._entries = OrderedDict()
+        self._size = size
+        self._hits = 0
+        self._misses = 0
+        # a driver thread may evaluate profiles while the solver runs
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def cacheable(x):
+        return isinstance(x, np.ndarray) and not x.flags.writeable and \
+            x.flags.owndata
+
+    def get(self, kind, player, x, compute):
+        key = (kind, player, id(x))
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._hits += 1
+                self._entries.move_to_end(key)
+                return entry[1]
+            self._misses += 1
+        value = compute()
+        value.flags.writeable = False
+        with self._lock:
+            if self._size > 0:
+                self._entries[key] = (x, value)
+                if len(self._entries) > self._size:
+                    self._entries.popitem(last=False)
+        return value
+
+    def info(self):
+        return CacheInfo(self._hits, self._misses, self._size,
+                         len(self._entries))
+
+
+def _largest_singular_value(A, iterations=100, tol=1e-6):
+    """Power iteration on A'A from a fixed random start. Each estimate
+    ||Av|| for a unit vector v is a lower bound; it stops once they change
+    by less than tol, relatively."""
+    v = np.random.default_rng(0).standard_normal(A.shape[1])
+    v /= np.linalg.norm(v)
+    estimate = 0.0
+    for _ in range(iterations):
+        u = A.dot(v)
+        previous, estimate = estimate, np.linalg.norm(u)
+        if estimate == 0.0 or estimate - previous <= tol * estimate:
+            break
+        v = A.T.dot(u)
+        v /= np.linalg.norm(v)
+    return estimate
+
+
+def _csr_matvec(A, x, out):
+    """out = A.dot(x) for a CSR matrix A, without allocating if scipy's
+    sparsetools are available."""
+    if _sparsetools_matvec is None or A.dtype != np.float64 or \
+            x.dtype != np.float64:
+        np.copyto(out, A.dot(x))
+        return out
+    out.fill(0.0)
+    _sparsetools_matvec(A.shape[0], A.shape[1], A.indptr, A.indices, A.data,
+                        x, out)
+    return out
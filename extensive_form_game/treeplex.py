@@ -1,13 +1,25 @@
 from __future__ import print_function
-import warnings
 import sys
 import math
 from collections import defaultdict
 from functools import partial
 from six.moves import zip as izip
-from scipy.stats import entropy
+from scipy.special import kl_div, xlogy
 import numpy as np
 
+# How often the solvers' is_behavioral_form assertions are evaluated:
+# never, on every validation_every'th check, or always.
+VALIDATION_OFF = 'off'
+VALIDATION_SAMPLED = 'sampled'
+VALIDATION_FULL = 'full'
+VALIDATION_LEVELS = (VALIDATION_OFF, VALIDATION_SAMPLED, VALIDATION_FULL)
+
+# The distance-generating functions prox() can be built on: the dilated
+# entropy and the dilated squared Euclidean norm.
+PROX_ENTROPY = 'entropy'
+PROX_EUCLIDEAN = 'euclidean'
+PROX_KINDS = (PROX_ENTROPY, PROX_EUCLIDEAN)
+
 
 class TreeplexDomain:
     def __init__(self,
@@ -20,53 +32,141 @@ class TreeplexDomain:
                  prox_scalar=1):
         if seq_to_str is None:
             seq_to_str = defaultdict()
-        self._forward_order = False
-        for i in range(0, len(begin)):
-            if parent[i] > begin[i]:
-                self._forward_order = True
-            assert parent[i] != begin[i]
-            assert begin[i] <= end[i]
+        begin = _index_array(begin)
+        end = _index_array(end)
+        parent = _index_array(parent)
+        assert np.all(parent != begin)
+        assert np.all(begin <= end)
+        self._forward_order = bool(np.any(parent > begin))
         if self._forward_order:
-            for i in range(0, len(begin)):
-                assert parent[i] > begin[i]
+            assert np.all(parent > begin)
         self._dimension = dimension
-        self._begin = begin
-        self._end = end
-        self._parent = parent
+        # infoset_traversal(), before _begin is set
+        traversal = range(len(begin))
+        if not self._forward_order:
+            traversal = traversal[::-1]
+        self._index = TreeplexIndex(dimension, begin, end, parent,
+                                    self.root_sequence(), traversal)
+        self._begin = self._index.begin
+        self._end = self._index.end
+        self._parent = self._index.parent
+        self._levels = self._index.levels
+        self.set_validation(VALIDATION_FULL)
         if prox_scalar == -1:
             if prox_infoset_weights:
-                prox_weight_scalar = 2.0 / np.sqrt(len(begin))
+                prox_scalar = 2.0 / np.sqrt(len(begin))
             else:
-                prox_weight_scalar = 1.0
+                prox_scalar = 1.0
         self._prox = TreeplexEntropyProx(
             self,
             self._weights(
                 infoset_weights=prox_infoset_weights,
                 weight_scalar=prox_scalar))
+        self._prox_weighting = prox_infoset_weights
+        if prox_infoset_weights not in ('kroer15', 'kroer17'):
+            # _weights() sets a bound on the diameter only for those
+            self._diameter = self._max_over_pure_strategies(
+                self._prox.pure_strategy_values())
         self._seq_to_str = seq_to_str
 
     def dimension(self):
         return self._dimension
 
+    def index(self):
+        return self._index
+
     def combine(self, y, alpha, x):
-        assert self.is_behavioral_form(x)
-        assert self.is_behavioral_form(y)
+        assert self.validate_behavioral_form(x)
+        assert self.validate_behavioral_form(y)
         seq_y = self.sequence_form(y)
         seq_x = self.sequence_form(x)
         return self.behavioral_form((1.0 - alpha) * seq_y + alpha * seq_x)
 
+    def combine_sequence_form(self, seq_y, alpha, x, out=None,
+                              workspace=None):
+        """combine() for a y that is already in sequence form.
+
+        Returns (1 - alpha)*seq_y + alpha*sequence_form(x) in sequence form.
+        out may be seq_y itself; workspace is scratch space for
+        sequence_form(x).
+        """
+        assert self.validate_behavioral_form(x)
+        seq_x = self.sequence_form(x, out=workspace)
+        if out is None:
+            return (1.0 - alpha) * seq_y + alpha * seq_x
+        np.multiply(seq_y, 1.0 - alpha, out=out)
+        seq_x *= alpha
+        out += seq_x
+        return out
+
     def prox(self):
         return self._prox
 
     def smooth_br(self):
         return self._prox.smooth_br
 
+    def set_prox(self, kind):
+        """Builds prox() and smooth_br() on the distance-generating function
+        kind, one of PROX_KINDS, with the same information set weights.
+        A new kind of prox also makes diameter() the range of its
+        distance-generating function. Solvers pick up the prox when they are
+        constructed."""
+        assert kind in PROX_KINDS
+        prox_class = (TreeplexEuclideanProx if kind == PROX_EUCLIDEAN
+                      else TreeplexEntropyProx)
+        if not isinstance(self._prox, prox_class):
+            self._prox = prox_class(self, self.prox_weights())
+            self._diameter = self._max_over_pure_strategies(
+                self._prox.pure_strategy_values())
+
+    def prox_weights(self):
+        """The information set weights of prox(), one per information set."""
+        return self._prox._weights
+
+    def prox_weighting(self):
+        """The prox_infoset_weights scheme the weights of prox() were built
+        with, or None once set_prox_weights() replaced them."""
+        return self._prox_weighting
+
+    def set_prox_weights(self, weights):
+        """Rebuilds prox() and smooth_br() with the information set weights
+        weights, on the same distance-generating function. diameter() becomes
+        the range of the new distance-generating function."""
+        weights = np.asarray(weights, dtype=np.float64)
+        assert weights.shape == self._prox._weights.shape
+        assert np.all(weights > 0)
+        self._prox = type(self._prox)(self, weights)
+        self._prox_weighting = None
+        self._diameter = self._max_over_pure_strategies(
+            self._prox.pure_strategy_values())
+
+    def _unit_modulus_weights(self):
+        """The kroer17 weights with prox_scalar 1 (see _weights), whose
+        dilated entropy is 1-strongly convex in the l1 norm."""
+        weights = np.zeros(len(self._begin))
+        seq_weights = np.zeros(self._dimension)
+        l1_max = np.zeros(self._dimension)
+        for level in reversed(self._index.levels):
+            weights[level.infosets] = 2 + level.max(seq_weights[level.seqs])
+            np.add.at(seq_weights, level.parents, weights[level.infosets])
+            np.add.at(l1_max, level.parents,
+                      1 + level.max(l1_max[level.seqs]))
+        return weights * l1_max[self.root_sequence()]
+
+    def _max_over_pure_strategies(self, values):
+        """The largest sum of values[j] over the information sets j that a
+        pure strategy reaches."""
+        best = np.zeros(self._dimension)
+        for level in reversed(self._index.levels):
+            v = values[level.infosets] + level.max(best[level.seqs])
+            np.add.at(best, level.parents, v)
+        return best[self.root_sequence()]
+
     def center(self):
         # set to 1/|A_I| for each infoset
         center = np.ones(self._dimension)
-        for i in range(0, len(self._begin)):
-            infoset_size = self._end[i] - self._begin[i]
-            center[self._begin[i]:self._end[i]] /= infoset_size
+        level = self._index.all_infosets
+        center[level.seqs] /= level.sizes[level.segment]
         return center
 
     def sequence_form_center(self):
@@ -92,65 +192,83 @@ class TreeplexDomain:
 
     """
     support function: argmax_{x\in\Delta} g'x
-    Returns support vector in behavioral strategy form.
+    Returns support vector in behavioral strategy form, or None if
+    compute_response is False.
     """
 
-    def support(self, g):
-        response = np.zeros(self._dimension)
-        response[self.root_sequence()] = 1
-        value = 0
-        for i in self.infoset_traversal():
-            begin = self._begin[i]
-            end = self._end[i]
-            parent = self._parent[i]
-            idx = np.argmax(g[begin:end])
-            response[begin + idx] = 1.0
-            if parent == self.root_sequence():
-                value += g[begin + idx]
-            else:
-                g[parent] += g[begin + idx]
-        return value, response
-
-    def infoset_regrets(self, g, x):
-        response = np.zeros(self._dimension)
-        response[self.root_sequence()] = 1
-
-        what_we_got = g
-        what_we_could_have_gotten = g.copy()
+    def support(self, g, compute_response=True):
+        g = np.array(g, dtype=np.float64)
+        # the root sequence accumulates the value of the best response
+        g[self.root_sequence()] = 0.0
+        response = None
+        if compute_response:
+            response = np.zeros(self._dimension)
+            response[self.root_sequence()] = 1
+        for level in reversed(self._levels):
+            block = g[level.seqs]
+            best = level.max(block)
+            if compute_response:
+                response[level.seqs[level.argmax(block, best)]] = 1.0
+            np.add.at(g, level.parents, best)
+        return g[self.root_sequence()], response
+
+    def infoset_regrets(self, g, x, compute_response=True):
+        response = None
+        if compute_response:
+            response = np.zeros(self._dimension)
+            response[self.root_sequence()] = 1
+
+        what_we_got = np.array(g, dtype=np.float64)
+        what_we_could_have_gotten = what_we_got.copy()
 
         regrets = np.zeros(len(self._begin))
-        for i in self.infoset_traversal():
-            begin = self._begin[i]
-            end = self._end[i]
-            parent = self._parent[i]
-            idx = np.argmax(what_we_could_have_gotten[begin:end])
-            response[begin + idx] = 1.0
-
-            ev_we_got = x[begin:end].dot(what_we_got[begin:end])
-            ev_we_could_have_gotten = what_we_could_have_gotten[begin + idx]
-
-            regrets[i] = ev_we_could_have_gotten - ev_we_got
-            if parent != self.root_sequence():
-                what_we_got[parent] += ev_we_got
-                what_we_could_have_gotten[parent] += ev_we_could_have_gotten
+        for level in reversed(self._levels):
+            could_have_gotten = what_we_could_have_gotten[level.seqs]
+            ev_we_could_have_gotten = level.max(could_have_gotten)
+            if compute_response:
+                response[level.seqs[level.argmax(
+                    could_have_gotten, ev_we_could_have_gotten)]] = 1.0
+
+            ev_we_got = level.sum(
+                np.asarray(x)[level.seqs] * what_we_got[level.seqs])
+
+            regrets[level.infosets] = ev_we_could_have_gotten - ev_we_got
+            np.add.at(what_we_got, level.parents, ev_we_got)
+            np.add.at(what_we_could_have_gotten, level.parents,
+                      ev_we_could_have_gotten)
         return regrets, response
 
-    def sequence_form(self, x):
-        seq = np.copy(x)
-        for i in self.reverse_infoset_traversal():
-            Z = np.sum(seq[self._begin[i]:self._end[i]])
-            if Z > 0.0:
-                seq[self._begin[i]:self._end[i]] *= seq[self._parent[i]] / Z
+    def sequence_form(self, x, out=None):
+        if out is None:
+            seq = np.array(x, dtype=np.float64)
+        else:
+            seq = out
+            np.copyto(seq, x)
+        # top-down: the parent sequences of a level are final before the
+        # level itself is rescaled
+        for level in self._levels:
+            block = seq[level.seqs]
+            Z = level.sum(block)
+            scale = np.ones(len(Z))
+            positive = Z > 0.0
+            scale[positive] = seq[level.parents[positive]] / Z[positive]
+            seq[level.seqs] = block * scale[level.segment]
         return seq
 
-    def behavioral_form(self, seq):
-        x = np.copy(seq)
-        for begin, end in zip(self._begin, self._end):
-            Z = np.sum(seq[begin:end])
-            if Z == 0:
-                x[begin:end] /= 1.0 / (end - begin)
-            else:
-                x[begin:end] /= Z
+    def behavioral_form(self, seq, out=None):
+        if out is None:
+            x = np.array(seq, dtype=np.float64)
+        else:
+            x = out
+            np.copyto(x, seq)
+        level = self._index.all_infosets
+        block = x[level.seqs]
+        Z = level.sum(block)
+        # information sets that are never reached get the uniform strategy
+        unreached = Z == 0
+        block[unreached[level.segment]] = 1.0
+        Z[unreached] = level.sizes[unreached]
+        x[level.seqs] = block / Z[level.segment]
         return x
 
     # For kroer17 this computes weights that ensure strong convexity
@@ -216,12 +334,30 @@ class TreeplexDomain:
             np.savetxt(f, np.matrix(row), fmt="%i")
 
     def is_behavioral_form(self, x):
-        for i in self.infoset_traversal():
-            begin = self._begin[i]
-            end = self._end[i]
-            if abs(sum(x[begin:end]) - 1) > 1e-8:
-                return False
-        return True
+        level = self._index.all_infosets
+        Z = level.sum(np.asarray(x, dtype=np.float64)[level.seqs])
+        return not np.any(np.abs(Z - 1) > 1e-8)
+
+    def set_validation(self, level, every=1):
+        assert level in VALIDATION_LEVELS
+        assert every >= 1
+        self._validation = level
+        self._validation_every = every
+        self._validation_count = 0
+
+    def validate_behavioral_form(self, x):
+        """is_behavioral_form(x), subject to the validation level.
+
+        Meant to be asserted in solver hot paths. Returns True without
+        looking at x when the check is skipped.
+        """
+        if self._validation == VALIDATION_OFF:
+            return True
+        if self._validation == VALIDATION_SAMPLED:
+            self._validation_count += 1
+            if self._validation_count % self._validation_every != 0:
+                return True
+        return self.is_behavioral_form(x)
 
     def infoset_traversal(self):
         if self._forward_order:
@@ -243,6 +379,254 @@ class TreeplexDomain:
         return 'TreeplexDomain(%d)' % self._dimension
 
 
+class BatchedTreeplexDomain(TreeplexDomain):
+    """batch_size copies of a treeplex, the strategy space of a player in a
+    BatchedExtensiveFormGame.
+
+    A strategy of the batch concatenates one strategy of domain per game,
+    i.e. it is a (batch_size, dimension) array stored row by row, and
+    unstack() returns it in that shape. The copies are indexed as a single
+    treeplex whose levels hold the information sets of all games, game by
+    game, so the level-at-a-time kernels of TreeplexDomain process every
+    game in one pass and compute the same values as they do on domain. Each
+    copy keeps its own root sequence: root_sequence() is an array, and the
+    values the kernels compute at the root (that of support(), smooth_br()
+    and distance_generating_function()) have one entry per game.
+    """
+
+    def __init__(self, domain, batch_size):
+        index = domain.index()
+        dimension = domain.dimension()
+        num_infosets = domain.num_information_sets()
+        seq_shift = np.repeat(
+            np.arange(batch_size) * dimension, num_infosets)
+        infoset_shift = np.repeat(
+            np.arange(batch_size) * num_infosets, num_infosets)
+        begin = np.tile(index.begin, batch_size) + seq_shift
+        end = np.tile(index.end, batch_size) + seq_shift
+        parent = np.tile(index.parent, batch_size) + seq_shift
+        self._traversal = np.tile(
+            np.asarray(domain.infoset_traversal()), batch_size) + infoset_shift
+
+        self._unbatched = domain
+        self._batch_size = batch_size
+        self._dimension = batch_size * dimension
+        self._forward_order = domain._forward_order
+        self._roots = _frozen(
+            np.arange(batch_size) * dimension + domain.root_sequence())
+        self._index = TreeplexIndex(self._dimension, begin, end, parent,
+                                    self._roots, self._traversal)
+        self._begin = self._index.begin
+        self._end = self._index.end
+        self._parent = self._index.parent
+        self._levels = self._index.levels
+        self.set_validation(VALIDATION_FULL)
+        self._prox = type(domain.prox())(
+            self, np.tile(domain.prox_weights(), batch_size))
+        self._prox_weighting = domain.prox_weighting()
+        self._seq_to_str = domain._seq_to_str
+
+    def batch_size(self):
+        return self._batch_size
+
+    def unbatched(self):
+        """The treeplex of a single game."""
+        return self._unbatched
+
+    def unstack(self, x):
+        """x as a (batch_size, dimension) array, one row per game."""
+        return np.reshape(x, (self._batch_size, -1))
+
+    def diameter(self):
+        return self._unbatched.diameter()
+
+    def infoset_traversal(self):
+        return self._traversal
+
+    def reverse_infoset_traversal(self):
+        return self._traversal[::-1]
+
+    def root_sequence(self):
+        return self._roots
+
+    def __repr__(self):
+        return 'BatchedTreeplexDomain(%d x %d)' % (
+            self._batch_size, self._unbatched.dimension())
+
+
+def _index_array(values):
+    return np.asarray(list(values), dtype=np.int32)
+
+
+def _frozen(array):
+    array = np.ascontiguousarray(array, dtype=np.int32)
+    array.flags.writeable = False
+    return array
+
+
+def _segment_ranges(begin, sizes):
+    """Concatenation of range(begin[i], begin[i] + sizes[i]) over all i."""
+    starts = np.cumsum(sizes) - sizes
+    return np.repeat(begin - starts, sizes) + np.arange(np.sum(sizes))
+
+
+def _project_to_simplices(values, level):
+    """Euclidean projection of each information set's slice of values, which
+    is aligned with level.seqs, onto its probability simplex.
+
+    The sort-based algorithm (Held et al. 1974) for all slices at once: with
+    a slice sorted in decreasing order as u, the projection is
+    max(values - theta, 0), where theta = (u_1 + ... + u_rho - 1) / rho and
+    rho is the largest k with k*u_k > u_1 + ... + u_k - 1.
+    """
+    order = np.lexsort((-values, level.segment))
+    u = values[order]
+    # prefix sums that restart at each information set
+    cumulative = np.cumsum(u)
+    cumulative -= (cumulative[level.starts] - u[level.starts])[level.segment]
+    rank = np.arange(1, len(u) + 1) - level.starts[level.segment]
+    rho = np.maximum.reduceat(np.where(rank * u > cumulative - 1, rank, 0),
+                              level.starts)
+    theta = (cumulative[level.starts + rho - 1] - 1) / rho
+    return np.maximum(values - theta[level.segment], 0.0)
+
+
+class TreeplexIndex:
+    """Read-only int32 arrays describing the structure of a treeplex.
+
+    Built once per TreeplexDomain, this is what the vectorized kernels run
+    off. Information sets are grouped by depth, the number of information
+    sets on the path from the root to them, so the parent sequences of a
+    level all belong to the previous level.
+
+    begin, end, parent, sizes: per information set
+    seq_to_infoset: information set of each sequence, -1 for the root
+    depth: per information set
+    order: the nonempty information sets sorted by depth (stable with
+        respect to the infoset traversal, so that accumulations into a
+        parent sequence happen in the same order as in a sequential
+        traversal); level d is order[level_ptr[d]:level_ptr[d + 1]]
+    seqs, seq_ptr: the sequences of order[k] are
+        seqs[seq_ptr[k]:seq_ptr[k + 1]]
+    children, children_ptr: CSR lists of the child information sets of each
+        sequence; those of sequence s are
+        children[children_ptr[s]:children_ptr[s + 1]]
+    levels: one _TreeplexLevel per depth, top-down
+    all_infosets: a _TreeplexLevel over all nonempty information sets, in
+        index order
+    """
+
+    def __init__(self, dimension, begin, end, parent, root, traversal):
+        begin = np.asarray(begin, dtype=np.int64)
+        end = np.asarray(end, dtype=np.int64)
+        parent = np.asarray(parent, dtype=np.int64)
+        sizes = end - begin
+        num_infosets = len(begin)
+
+        seq_to_infoset = np.full(dimension, -1, dtype=np.int64)
+        seq_to_infoset[_segment_ranges(begin, sizes)] = np.repeat(
+            np.arange(num_infosets), sizes)
+
+        # walk up the tree one information set at a time, for all information
+        # sets at once
+        depth = np.zeros(num_infosets, dtype=np.int64)
+        ancestor = seq_to_infoset[parent]
+        while np.any(ancestor >= 0):
+            above = ancestor >= 0
+            depth[above] += 1
+            ancestor[above] = seq_to_infoset[parent[ancestor[above]]]
+
+        traversal = np.asarray(traversal, dtype=np.int64)
+        traversal = traversal[sizes[traversal] > 0]
+        order = traversal[np.argsort(depth[traversal], kind='stable')]
+        num_levels = np.max(depth, initial=-1) + 1
+        level_ptr = np.searchsorted(depth[order], np.arange(num_levels + 1))
+        seq_ptr = np.concatenate(([0], np.cumsum(sizes[order])))
+
+        children = np.argsort(parent, kind='stable')
+        children_ptr = np.concatenate(
+            ([0], np.cumsum(np.bincount(parent, minlength=dimension))))
+
+        self.dimension = dimension
+        self.root = root
+        self.begin = _frozen(begin)
+        self.end = _frozen(end)
+        self.parent = _frozen(parent)
+        self.sizes = _frozen(sizes)
+        self.seq_to_infoset = _frozen(seq_to_infoset)
+        self.depth = _frozen(depth)
+        self.order = _frozen(order)
+        self.level_ptr = _frozen(level_ptr)
+        self.seqs = _frozen(_segment_ranges(begin[order], sizes[order]))
+        self.seq_ptr = _frozen(seq_ptr)
+        self.children = _frozen(children)
+        self.children_ptr = _frozen(children_ptr)
+
+        self.levels = tuple(
+            self._level(level_ptr[d], level_ptr[d + 1])
+            for d in range(num_levels))
+        self.all_infosets = _TreeplexLevel(self, _frozen(np.sort(order)))
+
+    def _level(self, first, last):
+        seqs = self.seqs[self.seq_ptr[first]:self.seq_ptr[last]]
+        return _TreeplexLevel(self, self.order[first:last], seqs)
+
+    def num_levels(self):
+        return len(self.levels)
+
+    def child_infosets(self, seq):
+        return self.children[self.children_ptr[seq]:self.children_ptr[seq + 1]]
+
+    def bottom_up(self):
+        """Nonempty information sets, children before parents."""
+        if not self.levels:
+            return self.order
+        return np.concatenate(
+            [level.infosets for level in reversed(self.levels)])
+
+
+class _TreeplexLevel:
+    """Index arrays for processing a set of information sets at once.
+
+    seqs concatenates the sequences of the information sets, starts holds
+    the offset of each information set in seqs (suitable for
+    np.ufunc.reduceat) and segment maps each entry of seqs back to the
+    position of its information set.
+    """
+
+    def __init__(self, index, infosets, seqs=None):
+        self.infosets = infosets
+        self.parents = _frozen(index.parent[infosets])
+        self.sizes = _frozen(index.sizes[infosets])
+        self.starts = _frozen(np.cumsum(self.sizes) - self.sizes)
+        if seqs is None:
+            seqs = _segment_ranges(index.begin[infosets], self.sizes)
+        self.seqs = _frozen(seqs)
+        self.segment = _frozen(np.repeat(np.arange(len(infosets)), self.sizes))
+
+    def sum(self, values):
+        """Per-information-set sums of values, which is aligned with seqs."""
+        # bincount accumulates in order, like a sequential sum
+        return np.bincount(self.segment, weights=values, minlength=len(self))
+
+    def min(self, values):
+        return np.minimum.reduceat(values, self.starts)
+
+    def max(self, values):
+        return np.maximum.reduceat(values, self.starts)
+
+    def argmax(self, values, maxima=None):
+        """Positions in seqs of the first maximum of each information set."""
+        if maxima is None:
+            maxima = self.max(values)
+        positions = np.arange(len(values))
+        positions[values != maxima[self.segment]] = len(values)
+        return np.minimum.reduceat(positions, self.starts)
+
+    def __len__(self):
+        return len(self.infosets)
+
+
 class TreeplexEntropyProx:
     def __init__(self, treeplex, weights):
         self._treeplex = treeplex
@@ -251,103 +635,283 @@ class TreeplexEntropyProx:
         self._begin = treeplex._begin
         self._end = treeplex._end
         self._parent = treeplex._parent
-        self._center_shift = self.distance_generating_function(self.center())
+        # scratch space of smooth_br and __call__
+        self._g_buffer = np.zeros(self._dimension)
+        self._gradient_buffer = np.zeros(self._dimension)
 
     def distance_generating_function(self, x):
-        assert self._treeplex.is_behavioral_form(x)
+        assert self._treeplex.validate_behavioral_form(x)
+        x = np.asarray(x, dtype=np.float64)
         v_vec = np.zeros(self._dimension)
-        total = 0
-        for i in self._treeplex.infoset_traversal():
-            begin = self._begin[i]
-            end = self._end[i]
-            parent = self._parent[i]
-            simplex_dimension = end - begin
-            dgf_weight = self._weights[i]
-
-            v = dgf_weight * (-entropy(x[begin: end]) + np.log(simplex_dimension)) + \
-                np.dot(x[begin: end], v_vec[begin: end])
-            if parent != self._treeplex.root_sequence():
-                v_vec[parent] += v
-            else:
-                total += v
-        return total
-
-    def bregman_divergence(self, x, x_center):
-        assert self._treeplex.is_behavioral_form(x)
-        assert self._treeplex.is_behavioral_form(x_center)
-        dgf_x = self.distance_generating_function(x)
-        dgf_center = self.distance_generating_function(x_center)
-        inner_prod = self.gradient(x_center).dot(
-            self._treeplex.sequence_form(x) -
-            self._treeplex.sequence_form(x_center))
-        return dgf_x - dgf_center - inner_prod
+        for level in reversed(self._treeplex.index().levels):
+            block = x[level.seqs]
+            dgf_weight = self._weights[level.infosets]
+
+            # -entropy of each (normalized) slice
+            p = block / level.sum(block)[level.segment]
+            v = dgf_weight * (level.sum(xlogy(p, p)) + np.log(level.sizes)) + \
+                level.sum(block * v_vec[level.seqs])
+            np.add.at(v_vec, level.parents, v)
+        return v_vec[self._treeplex.root_sequence()]
+
+    def bregman_divergence(self, x, x_center, seq=None):
+        """D(x, x_center) in its dilated form: the sum over information sets
+        j of w_j * x[parent of j] * KL(x_j || x_center_j), with the parent
+        sequence in the sequence form of x (seq, if given). Unlike
+        dgf(x) - dgf(x_center) - <gradient(x_center), x - x_center> it does
+        not cancel when x and x_center are close."""
+        assert self._treeplex.validate_behavioral_form(x)
+        assert self._treeplex.validate_behavioral_form(x_center)
+        x = np.asarray(x, dtype=np.float64)
+        x_center = np.asarray(x_center, dtype=np.float64)
+        if seq is None:
+            seq = self._treeplex.sequence_form(x)
+        level = self._treeplex.index().all_infosets
+        kl = level.sum(kl_div(x[level.seqs], x_center[level.seqs]))
+        return np.dot(self._weights[level.infosets] * seq[level.parents], kl)
 
     def center(self):
         _, arg = self.smooth_br(0.0, np.zeros(self._dimension), 1.0)
         return arg
 
+    def strong_convexity_modulus(self):
+        """A lower bound on the modulus of strong convexity in the l1 norm
+        of the sequence form. With the kroer17 weights v of modulus 1,
+        d_w - c * d_v is a sum of dilated convex functions for
+        c = min_j w_j / v_j, so d_w has modulus at least c."""
+        return np.min(self._weights / self._treeplex._unit_modulus_weights())
+
+    def pure_strategy_values(self):
+        """The term of each information set j in the distance-generating
+        function when j is reached and plays a pure action, w_j * log(n_j).
+        The function is convex and 0 at the center, so its largest value,
+        attained at a pure strategy, is the sum of these over the reached
+        information sets."""
+        return self._weights * np.log(
+            np.maximum(self._treeplex.index().sizes, 1))
+
+    def hessian_diagonal(self, x):
+        """Diagonal of the Hessian of the distance-generating function in
+        sequence form at the behavioral strategy x: w_j / x_a from the
+        information set j of sequence a, plus w_k / x_a for each information
+        set k that a leads to. It is infinite at the root sequence."""
+        seq = self._treeplex.sequence_form(x)
+        infoset = self._treeplex.index().seq_to_infoset
+        inside = infoset >= 0
+        level = self._treeplex.index().all_infosets
+        curvature = np.zeros(self._dimension)
+        curvature[inside] = self._weights[infoset[inside]]
+        np.add.at(curvature, level.parents, self._weights[level.infosets])
+        with np.errstate(divide='ignore'):
+            hessian = curvature / seq
+        hessian[self._treeplex.root_sequence()] = np.inf
+        return hessian
+
     """
     argmin_{x\in\Delta} alpha*g'x + beta*D(x, y)
 
     """
 
-    def __call__(self, alpha, g, beta, y):
-        assert self._treeplex.is_behavioral_form(y)
-        return self.smooth_br(1., alpha * g - self.gradient(y, beta), beta)
+    def __call__(self, alpha, g, beta, y=None, out=None):
+        if y is None:
+            return self.smooth_br(alpha, g, beta, out=out)
+        assert self._treeplex.validate_behavioral_form(y)
+        shifted_g = self.gradient(y, beta, out=self._gradient_buffer)
+        np.multiply(g, alpha, out=self._g_buffer)
+        np.subtract(self._g_buffer, shifted_g, out=shifted_g)
+        return self.smooth_br(1., shifted_g, beta, out=out)
 
     # solves:
     # argmin_{x\in\Delta} alpha*g'x + beta*d(x)
-    def smooth_br(self, alpha, g, beta):
-        z = np.zeros(self._dimension)
+    #
+    # Bottom-up over the depth levels of the treeplex. At each information
+    # set the local problem is a simplex prox whose value is the segmented
+    # log-sum-exp offset - w*log(Z) + w*log(n), where offset is the smallest
+    # entry of the slice and Z the sum of exp(-(g - offset)/w). That value is
+    # then added to the parent sequence.
+    def smooth_br(self, alpha, g, beta, out=None):
+        z = np.zeros(self._dimension) if out is None else out
+        z.fill(0.0)
         z[self._treeplex.root_sequence()] = 1.0
-        g *= alpha
-        smoothed_br_value = g[self._treeplex.root_sequence()]
-        for i in self._treeplex.infoset_traversal():
-            begin = self._begin[i]
-            end = self._end[i]
-            parent = self._parent[i]
-            dgf_weight = beta * self._weights[i]
+        g = np.multiply(g, alpha, out=self._g_buffer)
+        for level in reversed(self._treeplex.index().levels):
+            block = g[level.seqs]
+            dgf_weight = beta * self._weights[level.infosets]
 
-            offset = np.min(g[begin:end])
+            offset = level.min(block)
 
-            z[begin:end] = np.exp(-(1.0 / dgf_weight) *
-                                  (g[begin:end] - offset))
+            block = np.exp(-(1.0 / dgf_weight[level.segment]) *
+                           (block - offset[level.segment]))
 
-            Z = np.sum(z[begin:end])
-            z[begin:end] /= Z
+            Z = level.sum(block)
+            z[level.seqs] = block / Z[level.segment]
 
-            best_idx = 0
-            best_z = 0
-            for idx in range(begin, end):
-                if z[idx] > best_z:
-                    best_idx = idx
-                    best_z = z[idx]
-            v = g[best_idx] + dgf_weight * (
-                np.log(best_z) + np.log(end - begin))
+            v = offset + dgf_weight * (np.log(level.sizes) - np.log(Z))
 
-            if parent != self._treeplex.root_sequence():
-                g[parent] += v
-            else:
-                smoothed_br_value += v
+            # the parents of the top level are all the root sequence, which
+            # accumulates the smoothed best-response value
+            np.add.at(g, level.parents, v)
 
-        assert self._treeplex.is_behavioral_form(z)
-        return smoothed_br_value, z
+        assert self._treeplex.validate_behavioral_form(z)
+        return g[self._treeplex.root_sequence()], z
 
-    def gradient(self, strategy, mu=1.0):
-        gradient = np.zeros(self._dimension)
-        for i in self._treeplex.infoset_traversal():
-            begin = self._begin[i]
-            end = self._end[i]
-            parent = self._parent[i]
+    def gradient(self, strategy, mu=1.0, out=None):
+        infoset = self._treeplex.index().seq_to_infoset
+        inside = infoset >= 0
+        weights = mu * self._weights
+
+        # log(0) = -inf, without the divide-by-zero warning
+        gradient = np.empty(self._dimension) if out is None else out
+        gradient.fill(-np.inf)
+        strategy = np.asarray(strategy, dtype=np.float64)
+        np.log(strategy, out=gradient, where=strategy > 0)
+
+        gradient[inside] = weights[infoset[inside]] * (1.0 + gradient[inside])
+        gradient[~inside] = 0.0
 
-            for idx in range(begin, end):
-                # catch log-of-zero warning and stop it from printing
-                with warnings.catch_warnings():
-                    warnings.simplefilter("ignore")
-                    gradient[idx] += mu * self._weights[i] * (
-                        1.0 + np.log(strategy[idx]))
+        level = self._treeplex.index().all_infosets
+        np.add.at(gradient, level.parents, -weights[level.infosets] *
+                  (1.0 - np.log(level.sizes)))
 
-            gradient[parent] -= mu * self._weights[i] * (
-                1.0 - np.log(end - begin))
+        return gradient
+
+
+class TreeplexEuclideanProx:
+    """The prox of the dilated squared Euclidean norm
+
+        d(x) = sum over information sets j of
+               w_j * x[parent of j] * (||x_j||^2 / 2 - 1 / (2 n_j)),
+
+    where x_j is the behavioral strategy at j and n_j its number of actions.
+    It has the interface of TreeplexEntropyProx. Its local problems are
+    Euclidean projections onto simplices, computed a level at a time by
+    _project_to_simplices(), so a prox step needs no exp or log.
+    """
+
+    def __init__(self, treeplex, weights):
+        self._treeplex = treeplex
+        self._dimension = treeplex._dimension
+        self._weights = weights
+        # scratch space of smooth_br and __call__
+        self._g_buffer = np.zeros(self._dimension)
+        self._gradient_buffer = np.zeros(self._dimension)
+
+    def distance_generating_function(self, x):
+        assert self._treeplex.validate_behavioral_form(x)
+        x = np.asarray(x, dtype=np.float64)
+        v_vec = np.zeros(self._dimension)
+        for level in reversed(self._treeplex.index().levels):
+            block = x[level.seqs]
+            v = self._weights[level.infosets] * (
+                0.5 * level.sum(block * block) - 0.5 / level.sizes) + \
+                level.sum(block * v_vec[level.seqs])
+            np.add.at(v_vec, level.parents, v)
+        return v_vec[self._treeplex.root_sequence()]
+
+    def bregman_divergence(self, x, x_center, seq=None):
+        """D(x, x_center) in its dilated form: the sum over information sets
+        j of w_j * x[parent of j] * ||x_j - x_center_j||^2 / 2, with the
+        parent sequence in the sequence form of x (seq, if given)."""
+        assert self._treeplex.validate_behavioral_form(x)
+        assert self._treeplex.validate_behavioral_form(x_center)
+        x = np.asarray(x, dtype=np.float64)
+        x_center = np.asarray(x_center, dtype=np.float64)
+        if seq is None:
+            seq = self._treeplex.sequence_form(x)
+        level = self._treeplex.index().all_infosets
+        difference = x[level.seqs] - x_center[level.seqs]
+        squared = 0.5 * level.sum(difference * difference)
+        return np.dot(self._weights[level.infosets] * seq[level.parents],
+                      squared)
+
+    def center(self):
+        _, arg = self.smooth_br(0.0, np.zeros(self._dimension), 1.0)
+        return arg
+
+    def strong_convexity_modulus(self):
+        """None: no bound on the modulus of strong convexity of the dilated
+        squared Euclidean norm in the l1 norm is known here."""
+        return None
+
+    def pure_strategy_values(self):
+        """The term of each information set j in the distance-generating
+        function when j is reached and plays a pure action,
+        w_j * (1 - 1 / n_j) / 2 (see TreeplexEntropyProx)."""
+        return self._weights * (
+            0.5 - 0.5 / np.maximum(self._treeplex.index().sizes, 1))
+
+    def hessian_diagonal(self, x):
+        """Diagonal of the Hessian of the distance-generating function in
+        sequence form at the behavioral strategy x: w_j / x[parent of j]
+        from the information set j of sequence a, plus w_k * ||x_k||^2 / x_a
+        for each information set k that a leads to. It is infinite at the
+        root sequence."""
+        seq = self._treeplex.sequence_form(x)
+        x = np.asarray(x, dtype=np.float64)
+        level = self._treeplex.index().all_infosets
+        hessian = np.zeros(self._dimension)
+        with np.errstate(divide='ignore'):
+            hessian[level.seqs] = (self._weights[level.infosets] /
+                                   seq[level.parents])[level.segment]
+            block = x[level.seqs]
+            np.add.at(hessian, level.parents,
+                      self._weights[level.infosets] *
+                      level.sum(block * block) / seq[level.parents])
+        hessian[self._treeplex.root_sequence()] = np.inf
+        return hessian
+
+    # argmin_{x\in\Delta} alpha*g'x + beta*D(x, y)
+    def __call__(self, alpha, g, beta, y=None, out=None):
+        if y is None:
+            return self.smooth_br(alpha, g, beta, out=out)
+        assert self._treeplex.validate_behavioral_form(y)
+        shifted_g = self.gradient(y, beta, out=self._gradient_buffer)
+        np.multiply(g, alpha, out=self._g_buffer)
+        np.subtract(self._g_buffer, shifted_g, out=shifted_g)
+        return self.smooth_br(1., shifted_g, beta, out=out)
+
+    # solves:
+    # argmin_{x\in\Delta} alpha*g'x + beta*d(x)
+    #
+    # Bottom-up over the depth levels of the treeplex. At each information
+    # set the local problem min_p g_j'p + w*||p||^2/2 is solved by the
+    # projection of -g_j/w onto the simplex, and its value (less the
+    # constant w/(2n)) is added to the parent sequence.
+    def smooth_br(self, alpha, g, beta, out=None):
+        z = np.zeros(self._dimension) if out is None else out
+        z.fill(0.0)
+        z[self._treeplex.root_sequence()] = 1.0
+        g = np.multiply(g, alpha, out=self._g_buffer)
+        for level in reversed(self._treeplex.index().levels):
+            block = g[level.seqs]
+            dgf_weight = beta * self._weights[level.infosets]
+
+            p = _project_to_simplices(-block / dgf_weight[level.segment],
+                                      level)
+            z[level.seqs] = p
+
+            v = level.sum(block * p) + dgf_weight * (
+                0.5 * level.sum(p * p) - 0.5 / level.sizes)
+            np.add.at(g, level.parents, v)
+
+        assert self._treeplex.validate_behavioral_form(z)
+        return g[self._treeplex.root_sequence()], z
+
+    def gradient(self, strategy, mu=1.0, out=None):
+        infoset = self._treeplex.index().seq_to_infoset
+        inside = infoset >= 0
+        weights = mu * self._weights
+
+        gradient = np.empty(self._dimension) if out is None else out
+        strategy = np.asarray(strategy, dtype=np.float64)
+        gradient[inside] = weights[infoset[inside]] * strategy[inside]
+        gradient[~inside] = 0.0
+
+        # the derivative by the parent sequence of
+        # x_parent * (||x_j / x_parent||^2 / 2 - 1/(2n))
+        level = self._treeplex.index().all_infosets
+        block = strategy[level.seqs]
+        np.add.at(gradient, level.parents, -weights[level.infosets] *
+                  (0.5 * level.sum(block * block) + 0.5 / level.sizes))
 
         return gradient
@@ -1,6 +1,27 @@
+from collections import namedtuple
 import numpy as np
 from .simplex import SimplexDomain
 
+
+class ProfileEvaluation(
+        namedtuple('ProfileEvaluation',
+                   ['epsilon', 'regret_x', 'regret_y', 'value'])):
+    """The quality of a profile (x, y): value is the utility of x, the
+    regrets are what each player gains by switching to a best response and
+    epsilon is their sum. Unpacks like the tuple profile_epsilon() used to
+    return."""
+
+    __slots__ = ()
+
+    @property
+    def best_response_x(self):
+        return self.regret_x + self.value
+
+    @property
+    def best_response_y(self):
+        return self.regret_y - self.value
+
+
 class MatrixGame:
     """
     represents the saddle-point problem:
@@ -16,25 +37,124 @@ class MatrixGame:
         else:
             self._B = A
         self._domains = (SimplexDomain(A.shape[0]), SimplexDomain(A.shape[1]))
+        # squared column norms of each player's payoff matrix, for
+        # sampled_utility_for
+        self._column_norms = [None, None]
 
     def domain(self, player):
         return self._domains[player]
 
     def profile_epsilon(self, x, y):
-        value   = self.profile_value(x, y)
-        br_x, _ = self.domain(0).support(self.utility_for(0, y))
-        br_y, _ = self.domain(1).support(self.utility_for(1, x))
-        return br_x + br_y, br_x - value, br_y + value, value
+        return self.evaluate(x, y)
+
+    def evaluate(self, x, y):
+        """profile_epsilon() and profile_value() from one utility vector per
+        player."""
+        u_x = self.utility_for(0, y)
+        value = np.dot(x, u_x)
+        br_x, _ = self.domain(0).support(u_x, compute_response=False)
+        br_y, _ = self.domain(1).support(self.utility_for(1, x),
+                                         compute_response=False)
+        return ProfileEvaluation(br_x + br_y, br_x - value, br_y + value, value)
 
     def profile_value(self, x, y):
         return np.dot(x, self.utility_for(0, y))
 
-    def utility_for(self, player, opponent_strategy):
+    def payoff_max_norm(self):
+        return np.max(np.abs(self._A))
+
+    def operator_norm(self, norm='prox'):
+        """max x'Ay over directions of norm 1 (see
+        ExtensiveFormGame.operator_norm): the largest |A_ij| for 'l1', the
+        spectral norm for 'l2' and, for 'prox', that of A scaled by the
+        Hessian diagonals of the proxes at their centers."""
+        if norm == 'l1':
+            return np.max(np.abs(self._A))
+        assert norm in ('l2', 'prox')
+        A = np.asarray(self._A, dtype=np.float64)
+        if norm == 'prox':
+            scale = [
+                1.0 / np.sqrt(domain.prox().hessian_diagonal(
+                    domain.prox().center())) for domain in self._domains
+            ]
+            A = scale[0][:, None] * A * scale[1][None, :]
+        return np.linalg.norm(A, 2)
+
+    def utility_for(self, player, opponent_strategy, out=None, workspace=None):
         if player == 0: # player 0 = matrix A
-            return np.dot(self._A, opponent_strategy)
+            return np.dot(self._A, opponent_strategy, out=out)
 
         assert player == 1 #player 1 = matrix B
-        return np.dot(self._B.T, opponent_strategy)
+        return np.dot(self._B.T, opponent_strategy, out=out)
+
+    def utility_for_sequence_form(self, player, opponent_strategy, out=None):
+        return self.utility_for(player, opponent_strategy, out=out)
+
+    def sampled_utility_for(self,
+                            player,
+                            opponent_strategy,
+                            num_samples,
+                            rng=None,
+                            out=None,
+                            workspace=None):
+        """Unbiased estimate of utility_for from num_samples opponent
+        actions (see sample_columns). Returns the estimate and an estimate
+        of its variance, summed over the entries."""
+        return self.sampled_utility_for_sequence_form(
+            player, opponent_strategy, num_samples, rng=rng, out=out)
+
+    def sampled_utility_for_sequence_form(self,
+                                          player,
+                                          opponent_strategy,
+                                          num_samples,
+                                          rng=None,
+                                          out=None):
+        M = self._A if player == 0 else self._B.T
+        if self._column_norms[player] is None:
+            self._column_norms[player] = np.sum(M**2, axis=0)
+        columns, counts, mass = sample_columns(opponent_strategy, num_samples,
+                                               rng)
+        estimate = np.dot(M[:, columns], counts * (mass / num_samples),
+                          out=out)
+        return estimate, sampled_variance(estimate, counts, mass,
+                                          self._column_norms[player][columns])
 
     def __str__(self):
         return 'MatrixGame(%s, %dx%d)' % (self._name, self._A.shape[0], self._A.shape[1])
+
+
+def sample_columns(weights, num_samples, rng=None):
+    """Draws num_samples columns with probability proportional to weights.
+
+    Returns the distinct columns drawn, how often each was drawn and the
+    total weight; M[:, columns].dot(counts * mass / num_samples) is then an
+    unbiased estimate of M.dot(weights). With no weight, nothing is drawn
+    and the estimate is 0.
+    """
+    rng = np.random.default_rng() if rng is None else rng
+    cumulative = np.cumsum(weights)
+    mass = cumulative[-1] if len(cumulative) > 0 else 0.0
+    if not mass > 0:
+        empty = np.zeros(0, np.int64)
+        return empty, empty, 0.0
+    draws = np.searchsorted(cumulative, rng.random(num_samples) * mass,
+                            side='right')
+    # r * mass may round up to mass, past the last column with weight
+    np.minimum(draws, np.flatnonzero(weights)[-1], out=draws)
+    counts = np.bincount(draws, minlength=len(weights))
+    columns = np.flatnonzero(counts)
+    return columns, counts[columns], mass
+
+
+def sampled_variance(estimate, counts, mass, column_norms):
+    """Unbiased estimate of the variance, summed over the entries, of an
+    estimate built from sample_columns; column_norms holds the squared
+    norms of the columns drawn."""
+    if mass == 0:
+        return 0.0
+    num_samples = np.sum(counts)
+    if num_samples < 2:
+        return np.nan
+    second_moment = mass**2 * np.dot(counts, column_norms) / num_samples
+    return max(second_moment - np.dot(estimate, estimate),
+               0.0) / (num_samples - 1)
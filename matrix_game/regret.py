@@ -1,3 +1,4 @@
+import numbers
 import numpy as np
 from scipy.optimize import fsolve
 from scipy.optimize import minimize_scalar
@@ -11,7 +12,9 @@ class Hedge:
         self.regret = np.zeros(dimension)
 
     def __call__(self, utility):
-        value = np.dot(self.strategy, utility)
+        # np.sum rather than np.dot, so that the segmented versions can
+        # reproduce the value exactly
+        value = np.sum(self.strategy * utility)
 
         self.regret += utility
         self.regret -= value
@@ -24,6 +27,9 @@ class Hedge:
 
         return value
 
+    def segmented(self):
+        return SegmentedHedge(self._alpha)
+
     def __str__(self):
         return 'Hedge(%f)' % self._alpha
 
@@ -35,7 +41,7 @@ class RegretMatching:
         self.regret = np.zeros(dimension)
 
     def __call__(self, utility):
-        value = np.dot(self.strategy, utility)
+        value = np.sum(self.strategy * utility)
 
         self.regret += utility
         self.regret -= value
@@ -51,6 +57,9 @@ class RegretMatching:
 
         return value
 
+    def segmented(self):
+        return SegmentedRegretMatching()
+
     def __str__(self):
         return 'RegretMatching'
 
@@ -62,7 +71,7 @@ class RegretMatchingPlus:
         self.regret = np.zeros(dimension)
 
     def __call__(self, utility):
-        value = np.dot(self.strategy, utility)
+        value = np.sum(self.strategy * utility)
 
         self.regret += utility
         self.regret -= value
@@ -79,14 +88,120 @@ class RegretMatchingPlus:
 
         return value
 
+    def segmented(self):
+        return SegmentedRegretMatching(plus=True)
+
     def __str__(self):
         return 'RegretMatching+'
 
 
-class ConicBlackwellPlus:
+class PredictiveRegretMatchingPlus:
+    """RM+ that picks its next strategy against a prediction of the next
+    utility. The prediction defaults to the utility just observed; CFR
+    passes the observed utility with the predicted values of the child
+    information sets instead. After a call, predicted_value is the value of
+    the prediction under the new strategy."""
+
+    predictive = True
+
     def __init__(self, dimension):
         self._dimension = dimension
         self.strategy = np.ones(dimension) / dimension
+        self.regret = np.zeros(dimension)
+        self.predicted_value = 0.0
+
+    def __call__(self, utility, prediction=None):
+        if prediction is None:
+            prediction = utility
+        value = np.sum(self.strategy * utility)
+        predicted_regret = prediction - np.sum(self.strategy * prediction)
+
+        self.regret += utility
+        self.regret -= value
+        np.maximum(self.regret, 0, out=self.regret)
+
+        predicted_regret += self.regret
+        np.maximum(predicted_regret, 0, out=self.strategy)
+
+        Z = np.sum(self.strategy)
+        if Z <= 0.0:
+            self.strategy.fill(1.0)
+            Z = self._dimension
+
+        self.strategy /= Z
+        self.predicted_value = np.sum(self.strategy * prediction)
+
+        return value
+
+    def segmented(self):
+        return SegmentedPredictiveRegretMatchingPlus()
+
+    def __str__(self):
+        return 'PredictiveRegretMatching+'
+
+
+class DiscountedRegretMatching:
+    """Regret matching with the regret discounting of Discounted CFR.
+
+    After iteration t, positive regrets are scaled by t^alpha / (t^alpha + 1)
+    and negative regrets by t^beta / (t^beta + 1). alpha = beta = 1 gives
+    linear CFR; beta = -inf drops negative regrets like RM+.
+    """
+
+    def __init__(self, dimension, alpha=1.5, beta=0.0):
+        self._dimension = dimension
+        self._alpha = alpha
+        self._beta = beta
+        self._t = 0
+        self.strategy = np.ones(dimension) / dimension
+        self.regret = np.zeros(dimension)
+
+    def __call__(self, utility):
+        value = np.sum(self.strategy * utility)
+
+        self.regret += utility
+        self.regret -= value
+
+        self._t += 1
+        positive, negative = regret_discounts(self._t, self._alpha, self._beta)
+        self.regret *= np.where(self.regret > 0, positive, negative)
+
+        np.maximum(self.regret, 0, out=self.strategy)
+
+        Z = np.sum(self.strategy)
+        if Z <= 0.0:
+            self.strategy.fill(1.0)
+            Z = self._dimension
+
+        self.strategy /= Z
+
+        return value
+
+    def segmented(self):
+        return SegmentedDiscountedRegretMatching(self._alpha, self._beta)
+
+    def __str__(self):
+        return 'DiscountedRegretMatching(%f, %f)' % (self._alpha, self._beta)
+
+
+def regret_discounts(t, alpha, beta):
+    """Discounts of positive and negative regrets after iteration t."""
+    positive = t**alpha / (t**alpha + 1.0)
+    if beta == -np.inf:
+        negative = 0.0
+    else:
+        negative = t**beta / (t**beta + 1.0)
+    return positive, negative
+
+
+class ConicBlackwellPlus:
+    """CBA+. With reference=True the cone projection uses the fsolve
+    root-finder instead of the closed form, for testing."""
+
+    def __init__(self, dimension, reference=False):
+        self._dimension = dimension
+        self._reference = reference
+        self.strategy = np.ones(dimension) / dimension
         self.regret_hat = np.zeros(dimension)
         self.regret_tilde = 0.0
 
@@ -112,10 +227,18 @@ class ConicBlackwellPlus:
         sol=sol.x
         return sol
 
+    # solving for y_tilde in closed form
+    def solve_for_y_tilde_sorted(self,u_tilde,u_hat):
+        return cone_projection_offset(np.array([u_tilde]), u_hat,
+                                      [len(u_hat)])[0]
+
     # compute the projection onto the cone
     def projection_on_cone(self,u_loc_tilde,u_loc_hat):
         # computing optimal y_tilde
-        y_tilde_star = self.solve_for_y_tilde_1(u_loc_tilde,u_loc_hat)
+        if self._reference:
+            y_tilde_star = self.solve_for_y_tilde_1(u_loc_tilde,u_loc_hat)
+        else:
+            y_tilde_star = self.solve_for_y_tilde_sorted(u_loc_tilde,u_loc_hat)
         # proj_u_tilde = u_tilde - y_tilde
         proj_u_tilde = u_loc_tilde - y_tilde_star
         # proj_u_hat = (u_hat+y_tilde*e)^+
@@ -124,7 +247,7 @@ class ConicBlackwellPlus:
         return proj_u_hat,proj_u_tilde
 
     def __call__(self, utility):
-        value = np.dot(self.strategy, utility)
+        value = np.sum(self.strategy * utility)
 
         # intermediate value for u_tilde and u_hat
         u_loc_tilde = self.regret_tilde - value
@@ -138,19 +261,229 @@ class ConicBlackwellPlus:
         self.regret_hat = proj_u_hat
 
         # update strategy
-        if sum(proj_u_hat)==0:
+        Z = np.sum(proj_u_hat)
+        if Z==0:
             self.strategy=np.ones(self._dimension)/self._dimension
             # print('degenerate proj')
         else:
-            self.strategy = proj_u_hat/sum(proj_u_hat)
+            self.strategy = proj_u_hat/Z
             # print('non-degenerate proj')
 
         return value
 
+    def segmented(self):
+        if self._reference:
+            raise ValueError(
+                'the reference projection works on one simplex at a time, '
+                'it cannot be batched')
+        return SegmentedConicBlackwellPlus()
+
+    def __str__(self):
+        return 'ConicBlackwell+'
+
+
+def cone_projection_offset(u_tilde, u_hat, sizes):
+    """Solves y + sum((u_hat + y)^+) = u_tilde for the CBA+ projection.
+
+    u_hat concatenates blocks of the given sizes and u_tilde holds one
+    value per block; returns one y per block. The left-hand side is
+    piecewise linear and increasing in y, so with the block sorted in
+    decreasing order y = (u_tilde - sum of the k largest) / (k + 1) for
+    the largest k whose k-th entry stays positive.
+    """
+    sizes = np.asarray(sizes)
+    columns = np.arange(np.max(sizes))
+    mask = columns < sizes[:, None]
+    u = np.full(mask.shape, -np.inf)
+    u[mask] = u_hat
+    u = -np.sort(-u, axis=1)
+    u[~mask] = 0.0
+    y = (u_tilde[:, None] - np.cumsum(u, axis=1)) / (columns + 2)
+    k = np.sum(np.logical_and.accumulate((u + y > 0) & mask, axis=1), axis=1)
+    return np.where(k > 0, y[np.arange(len(k)), k - 1], u_tilde)
+
+
+"""
+Segmented regret minimizers run the update of the corresponding simplex
+regret minimizer on many simplexes at once. regret, strategy and utility
+concatenate one block per simplex and are updated in place; segments
+describes the blocks (e.g. a level of a treeplex) through segment (the
+simplex of each entry), sizes, and per-simplex sum(values)/max(values).
+__call__ returns the value of each simplex under the old strategy.
+Minimizers with state beyond the regrets define init_state(segments); the
+arrays it returns are passed to every __call__ on those segments.
+"""
+
+
+class SegmentedHedge:
+    def __init__(self, alpha):
+        self._alpha = alpha
+
+    def __call__(self, regret, strategy, utility, segments):
+        value = segments.sum(strategy * utility)
+
+        regret += utility
+        regret -= value[segments.segment]
+
+        offset = segments.max(regret)
+        np.exp(self._alpha * (regret - offset[segments.segment]),
+               out=strategy)
+
+        Z = segments.sum(strategy)
+        strategy /= Z[segments.segment]
+
+        return value
+
+    def __str__(self):
+        return 'Hedge(%f)' % self._alpha
+
+
+class SegmentedRegretMatching:
+    def __init__(self, plus=False):
+        self._plus = plus
+
+    def __call__(self, regret, strategy, utility, segments):
+        value = segments.sum(strategy * utility)
+
+        regret += utility
+        regret -= value[segments.segment]
+
+        np.maximum(regret, 0, out=strategy)
+        if self._plus:
+            np.maximum(regret, 0, out=regret)
+
+        Z = segments.sum(strategy)
+        degenerate = Z <= 0.0
+        strategy[degenerate[segments.segment]] = 1.0
+        Z[degenerate] = segments.sizes[degenerate]
+
+        strategy /= Z[segments.segment]
+
+        return value
+
+    def __str__(self):
+        return 'RegretMatching+' if self._plus else 'RegretMatching'
+
+
+class SegmentedPredictiveRegretMatchingPlus:
+    predictive = True
+
+    def __init__(self):
+        self.predicted_value = None
+
+    def __call__(self, regret, strategy, utility, segments, prediction=None):
+        if prediction is None:
+            prediction = utility
+        value = segments.sum(strategy * utility)
+        predicted_regret = prediction - \
+            segments.sum(strategy * prediction)[segments.segment]
+
+        regret += utility
+        regret -= value[segments.segment]
+        np.maximum(regret, 0, out=regret)
+
+        predicted_regret += regret
+        np.maximum(predicted_regret, 0, out=strategy)
+
+        Z = segments.sum(strategy)
+        degenerate = Z <= 0.0
+        strategy[degenerate[segments.segment]] = 1.0
+        Z[degenerate] = segments.sizes[degenerate]
+
+        strategy /= Z[segments.segment]
+        self.predicted_value = segments.sum(strategy * prediction)
+
+        return value
+
+    def __str__(self):
+        return 'PredictiveRegretMatching+'
+
+
+class SegmentedDiscountedRegretMatching:
+    def __init__(self, alpha, beta):
+        self._alpha = alpha
+        self._beta = beta
+
+    def init_state(self, segments):
+        # the number of updates of these segments
+        return (np.zeros(1, dtype=int),)
+
+    def __call__(self, regret, strategy, utility, segments, t):
+        value = segments.sum(strategy * utility)
+
+        regret += utility
+        regret -= value[segments.segment]
+
+        t += 1
+        positive, negative = regret_discounts(t[0], self._alpha, self._beta)
+        regret *= np.where(regret > 0, positive, negative)
+
+        np.maximum(regret, 0, out=strategy)
+
+        Z = segments.sum(strategy)
+        degenerate = Z <= 0.0
+        strategy[degenerate[segments.segment]] = 1.0
+        Z[degenerate] = segments.sizes[degenerate]
+
+        strategy /= Z[segments.segment]
+
+        return value
+
+    def __str__(self):
+        return 'DiscountedRegretMatching(%f, %f)' % (self._alpha, self._beta)
+
+
+class SegmentedConicBlackwellPlus:
+    def init_state(self, segments):
+        # regret_tilde of every simplex
+        return (np.zeros(len(segments)),)
+
+    def __call__(self, regret, strategy, utility, segments, regret_tilde):
+        value = segments.sum(strategy * utility)
+
+        regret_tilde -= value
+        regret += utility
+
+        y_tilde = cone_projection_offset(regret_tilde, regret, segments.sizes)
+        regret_tilde -= y_tilde
+        regret += y_tilde[segments.segment]
+        np.maximum(regret, 0, out=regret)
+
+        Z = segments.sum(regret)
+        degenerate = Z == 0
+        strategy[:] = regret
+        strategy[degenerate[segments.segment]] = 1.0
+        Z[degenerate] = segments.sizes[degenerate]
+
+        strategy /= Z[segments.segment]
+
+        return value
+
     def __str__(self):
         return 'ConicBlackwell+'
 
 
+def minimizer_state(rm):
+    """The state of a simplex regret minimizer, for checkpoints: those of
+    its attributes that are arrays (over the simplex) or numbers."""
+    return {
+        name: value
+        for name, value in vars(rm).items()
+        if isinstance(value, (np.ndarray, numbers.Number))
+    }
+
+
+def restore_minimizer_state(rm, state):
+    """Sets the attributes that minimizer_state() returned. Arrays are
+    updated in place, since CFR may share them with other minimizers."""
+    for name, value in state.items():
+        old = getattr(rm, name)
+        if isinstance(old, np.ndarray):
+            old[...] = value
+        else:
+            setattr(rm, name, type(old)(value))
+
+
 def regret_matching_bound(dimension, payoff, num_iterations):
     return payoff * np.sqrt(dimension * num_iterations)
 
@@ -175,8 +508,22 @@ def regret_matching_plus_initializer():
 
     return init
 
-def conic_blackwell_plus_initializer():
+def predictive_regret_matching_plus_initializer():
+    def init(domain):
+        return PredictiveRegretMatchingPlus(domain.dimension())
+
+    return init
+
+
+def discounted_regret_matching_initializer(alpha=1.5, beta=0.0):
+    def init(domain):
+        return DiscountedRegretMatching(domain.dimension(), alpha, beta)
+
+    return init
+
+
+def conic_blackwell_plus_initializer(reference=False):
     def init(domain):
-        return ConicBlackwellPlus(domain.dimension())
+        return ConicBlackwellPlus(domain.dimension(), reference)
 
     return init
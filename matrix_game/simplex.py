@@ -12,6 +12,23 @@ class SimplexDomain:
     def combine(self, y, alpha, x):
         return (1.0 - alpha)*y + alpha*x
 
+    # a simplex is its own sequence form
+    def combine_sequence_form(self, seq_y, alpha, x, out=None, workspace=None):
+        if out is None:
+            return self.combine(seq_y, alpha, x)
+        np.multiply(seq_y, 1.0 - alpha, out=out)
+        out += alpha*x
+        return out
+
+    def sequence_form(self, x, out=None):
+        if out is None:
+            return np.array(x, dtype=np.float64)
+        np.copyto(out, x)
+        return out
+
+    def behavioral_form(self, seq, out=None):
+        return self.sequence_form(seq, out)
+
     def prox(self):
         return self._prox
 
@@ -24,9 +41,11 @@ class SimplexDomain:
     """
     support function: argmax_{x\in\Delta} g'x
     """
-    def support(self, g):
+    def support(self, g, compute_response=True):
         idx           = np.argmax(g)
         value         = g[idx]
+        if not compute_response:
+            return value, None
         response      = np.zeros(self._dimension)
         response[idx] = 1.0
         return value, response
@@ -47,6 +66,14 @@ class SimplexEntropyProx:
         _, arg = self(0.0, np.zeros(self._dimension), 1.0)
         return arg
 
+    def strong_convexity_modulus(self):
+        """The entropy is 1-strongly convex in the l1 norm (Pinsker)."""
+        return 1.0
+
+    def hessian_diagonal(self, x):
+        """The Hessian of the entropy at x, which is diagonal."""
+        return 1.0 / np.asarray(x, dtype=np.float64)
+
     def __call__(self, alpha, g, beta, y=None):
         """ Computes the argmin and value of the expression:
         argmin_{x\in\Delta} alpha*g'x + beta*D(x, y)
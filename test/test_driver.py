@@ -0,0 +1,117 @@
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+
+DRIVER = os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), 'driver.py')
+
+
+def run_driver(*args, **kwargs):
+    return subprocess.Popen([sys.executable, DRIVER, '--csv'] + list(args),
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                            universal_newlines=True, **kwargs)
+
+
+def csv_rows(*args):
+    """The CSV rows of a driver run, without the time column."""
+    driver = run_driver(*args)
+    out, err = driver.communicate(timeout=300)
+    assert driver.returncode == 0, err
+    lines = out.splitlines()
+    assert lines[0] == 'iters,gradients,eps,profile_val,algorithm,time'
+    return [line.rsplit(',', 1)[0] for line in lines[1:]]
+
+
+def forked_workers(pid):
+    """The child processes of pid that run its command line."""
+    def cmdline(pid):
+        with open('/proc/%d/cmdline' % pid, 'rb') as f:
+            return f.read()
+
+    with open('/proc/%d/task/%d/children' % (pid, pid)) as f:
+        children = [int(child) for child in f.read().split()]
+    return [child for child in children if cmdline(child) == cmdline(pid)]
+
+
+class TestDriver(unittest.TestCase):
+    def test_jobs(self):
+        args = ['-a', 'cfr+,cp,omd,egt', '-g', 'kuhn', '-t', '200',
+                '--num_outputs', '5']
+        sequential = csv_rows(*args)
+        assert len(sequential) == 4 * 5
+        assert csv_rows('--jobs', '2', *args) == sequential
+
+    def test_samples(self):
+        # each algorithm that --samples accepts supports it
+        driver = run_driver('-a', 'hedge,rm,rm+,cfr+,cba+,pcfr+,dcfr,lcfr,'
+                            'rm+_linear,mp', '-g', 'kuhn', '-t', '10',
+                            '--num_outputs', '2', '--samples', '5')
+        out, err = driver.communicate(timeout=300)
+        assert driver.returncode == 0, err
+        assert len([line for line in out.splitlines()
+                    if line.startswith('10,')]) == 10
+
+        # the others are rejected before any algorithm runs
+        for args in [('-a', 'cfr+,cp'), ('-a', 'cfr+,mp', '-s')]:
+            driver = run_driver('-g', 'kuhn', '--samples', '10', *args)
+            out, err = driver.communicate(timeout=60)
+            assert driver.returncode != 0
+            assert out == ''
+            assert 'supported' in err or 'compatible' in err
+
+    def test_async_eval(self):
+        args = ['-a', 'cfr+,cp,omd', '-g', 'kuhn', '-t', '200',
+                '--num_outputs', '10']
+        assert csv_rows('--async_eval', '2', *args) == csv_rows(*args)
+
+    def test_resume(self):
+        directory = tempfile.mkdtemp()
+        gnuplot = os.path.join(directory, 'plot')
+        args = ['-a', 'cfr+', '-g', 'kuhn', '--num_outputs', '5',
+                '--checkpoint_every', '50']
+        uninterrupted = csv_rows('-t', '200', '--checkpoint',
+                                 os.path.join(directory, 'full.npz'), *args)
+        args += ['--checkpoint', os.path.join(directory, 'resumed.npz')]
+        csv_rows('-t', '100', *args)
+        rows = csv_rows('-t', '200', '--resume', '--gnuplot', gnuplot, *args)
+        # iterations 0 and 50 were output by the first run
+        assert rows == uninterrupted[2:]
+        with open(gnuplot) as f:
+            lines = f.read().splitlines()
+        points = lines[lines.index('$alg0 << EOD') + 1:lines.index('EOD')]
+        assert [int(point.split()[0]) for point in points] == [100, 150, 200]
+
+    @unittest.skipUnless(os.path.exists('/proc/self/task'),
+                         'needs /proc to find the workers')
+    def test_killed_worker(self):
+        driver = run_driver('-a', 'cfr+,cp', '-g', 'kuhn', '-t', '100000000',
+                            '--num_outputs', '2', '--jobs', '2',
+                            start_new_session=True)
+        try:
+            workers = []
+            deadline = time.time() + 60
+            while len(workers) < 2 and time.time() < deadline:
+                time.sleep(0.1)
+                workers = forked_workers(driver.pid)
+            assert len(workers) == 2
+            os.kill(workers[0], signal.SIGKILL)
+            out, _ = driver.communicate(timeout=60)
+        finally:
+            # the driver and any worker it left running
+            try:
+                os.killpg(driver.pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+            driver.wait()
+        # instead of waiting for the killed worker's results forever
+        assert driver.returncode == 1
+        assert 'exited with code -%d' % signal.SIGKILL in out
+
+
+if __name__ == '__main__':
+    suite = unittest.TestLoader().loadTestsFromTestCase(TestDriver)
+    unittest.TextTestRunner(verbosity=2).run(suite)
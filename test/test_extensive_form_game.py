@@ -1,6 +1,9 @@
 import unittest
+from unittest import mock
 import numpy as np
 from poker import kuhn
+from extensive_form_game import extensive_form_game
+from matrix_game.game import sample_columns
 
 class TestExtensiveFormGame(unittest.TestCase):
     def setUp(self):
@@ -43,6 +46,165 @@ class TestExtensiveFormGame(unittest.TestCase):
         uniform_reach_p2 = self.kuhn.reach(1, self.p1_uniform_strat)
         assert np.array_equal(uniform_expected_reach_p2, uniform_reach_p2)
 
+    def test_profile_epsilon(self):
+        eps, br_x, br_y, value = self.kuhn.profile_epsilon(
+            self.p1_uniform_strat, self.p2_uniform_strat)
+        assert np.isclose(eps, br_x + br_y)
+        assert eps > 0
+        assert self.kuhn.max_infoset_regret(
+            self.p1_uniform_strat, self.p2_uniform_strat) > 0
+
+    def test_evaluate(self):
+        x, y = self.p1_pure_strat, self.p2_uniform_strat
+        evaluation = self.kuhn.evaluate(x, y)
+        assert evaluation.value == self.kuhn.profile_value(x, y)
+        br_x, _ = self.kuhn.domain(0).support(self.kuhn.utility_for(0, y))
+        br_y, _ = self.kuhn.domain(1).support(self.kuhn.utility_for(1, x))
+        assert np.isclose(evaluation.best_response_x, br_x)
+        assert np.isclose(evaluation.best_response_y, br_y)
+        assert evaluation.epsilon == evaluation.regret_x + evaluation.regret_y
+        assert tuple(evaluation) == tuple(self.kuhn.profile_epsilon(x, y))
+
+    def test_utility_for_out(self):
+        for player, strategy in [(0, self.p2_uniform_strat),
+                                 (1, self.p1_uniform_strat)]:
+            out = np.zeros(self.kuhn.domain(player).dimension())
+            workspace = np.zeros(self.kuhn.domain(1 - player).dimension())
+            u = self.kuhn.utility_for(player, strategy, out=out,
+                                      workspace=workspace)
+            assert u is out
+            assert np.array_equal(u, self.kuhn.utility_for(player, strategy))
+            assert np.array_equal(
+                workspace, self.kuhn.domain(1 - player).sequence_form(strategy))
+            # without scipy's private sparsetools
+            with mock.patch.object(extensive_form_game,
+                                   '_sparsetools_matvec', None):
+                fallback = np.zeros_like(out)
+                assert self.kuhn.utility_for(
+                    player, strategy, out=fallback) is fallback
+            assert np.allclose(fallback, u)
+
+    def test_sampled_utility_for(self):
+        rng = np.random.default_rng(0)
+        for player, strategy in [(0, self.p2_uniform_strat),
+                                 (1, self.p1_uniform_strat)]:
+            estimates = []
+            for _ in range(2000):
+                estimate, variance = self.kuhn.sampled_utility_for(
+                    player, strategy, 10, rng=rng)
+                assert variance >= 0
+                estimates.append(estimate)
+            assert np.allclose(np.mean(estimates, axis=0),
+                               self.kuhn.utility_for(player, strategy),
+                               atol=0.02)
+
+    def test_sample_columns(self):
+        class RoundingRng:
+            def random(self, size):
+                # r * mass rounds up to mass
+                return np.ones(size)
+
+        columns, counts, mass = sample_columns(
+            np.array([0.5, 0.5, 0.0]), 4, rng=RoundingRng())
+        assert list(columns) == [1] and list(counts) == [4] and mass == 1.0
+
+        # no mass on sequences with payoffs: nothing to draw
+        columns, counts, mass = sample_columns(np.zeros(3), 5)
+        assert len(columns) == 0 and mass == 0.0
+        estimate, variance = self.kuhn.sampled_utility_for_sequence_form(
+            0, np.zeros(self.kuhn.domain(1).dimension()), 5)
+        assert np.array_equal(estimate,
+                              np.zeros(self.kuhn.domain(0).dimension()))
+        assert variance == 0.0
+
+    def test_utility_cache(self):
+        game = kuhn.init_efg()
+        strategy = self.p2_uniform_strat.copy()
+        expected = game.utility_for(0, strategy)
+        # a writable strategy may change, so it is not cached
+        assert game.cache_info().hits == 0
+        strategy.flags.writeable = False
+        for _ in range(3):
+            u = game.utility_for(0, strategy)
+            assert np.array_equal(u, expected)
+            u += 1.0
+        assert game.cache_info().hits == 4
+        assert game.cache_info().misses == 2
+        out = np.zeros(game.domain(0).dimension())
+        workspace = np.zeros(game.domain(1).dimension())
+        game.utility_for(0, strategy, out=out, workspace=workspace)
+        assert np.array_equal(out, expected)
+        assert np.array_equal(workspace,
+                              game.domain(1).sequence_form(strategy))
+
+        for _ in range(20):
+            other = self.p2_pure_strat.copy()
+            other.flags.writeable = False
+            game.utility_for(0, other)
+        info = game.cache_info()
+        assert info.currsize == info.maxsize
+
+    def test_operator_norm(self):
+        def dense_norm(prox_weighted):
+            scale = []
+            for player in (0, 1):
+                domain = self.kuhn.domain(player)
+                s = np.ones(domain.dimension())
+                if prox_weighted:
+                    prox = domain.prox()
+                    s /= np.sqrt(prox.hessian_diagonal(prox.center()))
+                s[domain.root_sequence()] = 0.0
+                scale.append(s)
+            return np.linalg.norm(
+                scale[0][:, None] * self.kuhn._A.toarray() *
+                scale[1][None, :], 2)
+
+        # power iteration converges from below
+        for norm in ('l2', 'prox'):
+            expected = dense_norm(norm == 'prox')
+            assert expected * (1 - 1e-5) <= self.kuhn.operator_norm(norm) \
+                <= expected * (1 + 1e-12)
+
+        # new prox weights are not answered from the cache
+        norm = self.kuhn.operator_norm('prox')
+        for player in (0, 1):
+            domain = self.kuhn.domain(player)
+            domain.set_prox_weights(4 * domain.prox_weights())
+        assert np.isclose(self.kuhn.operator_norm('prox'), dense_norm(True),
+                          rtol=1e-5)
+        assert np.isclose(self.kuhn.operator_norm('prox'), norm / 4)
+
+    def test_precondition(self):
+        x, y = self.p1_pure_strat, self.p2_uniform_strat
+        evaluation = self.kuhn.evaluate(x, y)
+        weights = [self.kuhn.domain(p).prox_weights().copy() for p in (0, 1)]
+        norm = self.kuhn.operator_norm('prox')
+        self.kuhn.precondition(iterations=3)
+
+        # the payoffs, and so the evaluation of a profile, are unchanged
+        assert tuple(self.kuhn.evaluate(x, y)) == tuple(evaluation)
+        assert self.kuhn.operator_norm('prox') != norm
+        scale = [self.kuhn._directions(p, prox_weighted=True) for p in (0, 1)]
+        scaled = abs(scale[0][:, None] * self.kuhn._A.toarray() *
+                     scale[1][None, :])
+        assert np.isclose(np.max(scaled), 1.0)
+        for player, strategy in ((0, x), (1, self.p2_pure_strat)):
+            domain = self.kuhn.domain(player)
+            assert domain.prox_weights().shape == weights[player].shape
+            assert np.all(domain.prox_weights() > 0)
+            assert domain.prox_weighting() is None
+            # the range of the distance-generating function
+            assert domain.prox().distance_generating_function(strategy) <= \
+                domain.diameter() + 1e-12
+            assert np.isclose(domain.prox().distance_generating_function(
+                domain.center()), 0.0)
+
+        # the kroer weights already grow with the subtrees
+        for weights in ('kroer15', 'kroer17'):
+            game = kuhn.init_efg(prox_infoset_weights=weights)
+            with self.assertRaises(ValueError):
+                game.precondition()
+
 
 if __name__ == '__main__':
     suite = unittest.TestLoader().loadTestsFromTestCase(TestExtensiveFormGame)
@@ -1,6 +1,15 @@
+import os
+import tempfile
 import unittest
+from unittest import mock
 import numpy as np
 from poker import kuhn
+from extensive_form_game import extensive_form_game as efg
+from eqm import regret
+from eqm import chambolle_pock
+from eqm import mirror_prox
+from eqm import optimistic_mirror_descent
+from matrix_game import regret as matrix_regret
 
 class TestKuhn(unittest.TestCase):
     def setUp(self):
@@ -33,6 +42,143 @@ class TestKuhn(unittest.TestCase):
         strategy_p2 = np.array([ 1, 1, 0, 1, 0, 1, 0, 1, 0, 1, 0, 1, 0 ])
         assert abs(self.kuhn.profile_value(strategy_p1, strategy_p2)) < self.tolerance
 
+    def test_batched_cfr(self):
+        for initializer in [matrix_regret.hedge_initializer(1.0),
+                            matrix_regret.regret_matching_initializer(),
+                            matrix_regret.regret_matching_plus_initializer(),
+                            matrix_regret.conic_blackwell_plus_initializer(),
+                            matrix_regret.discounted_regret_matching_initializer(),
+                            matrix_regret.predictive_regret_matching_plus_initializer()]:
+            algorithms = [regret.regret_minimization_initializer(initializer, batched=batched)(self.kuhn)
+                          for batched in [False, True]]
+            for _ in range(50):
+                for algorithm in algorithms:
+                    algorithm.iterate()
+            x, y = algorithms[0].profile()
+            batched_x, batched_y = algorithms[1].profile()
+            assert np.array_equal(x, batched_x)
+            assert np.array_equal(y, batched_y)
+
+    def test_discounted_cfr(self):
+        dcfr = regret.discounted_cfr_initializer(alternate=True)(self.kuhn)
+        dcfr.iterate(200)
+        assert dcfr.epsilon() < 0.005
+        assert abs(dcfr.profile_value() + 0.0555555555) < 0.005
+
+    def test_predictive_cfr_plus(self):
+        pcfr = regret.regret_minimization_initializer(
+            matrix_regret.predictive_regret_matching_plus_initializer(),
+            alternate=True, averaging_exponent=2.0)(self.kuhn)
+        pcfr.iterate(200)
+        assert pcfr.epsilon() < 0.0005
+        assert abs(pcfr.profile_value() + 0.0555555555) < 0.0005
+
+    def test_batched_game(self):
+        domains = (self.kuhn.domain(0), self.kuhn.domain(1))
+        payoff_matrices = [self.kuhn._A, 2 * self.kuhn._A, -self.kuhn._A]
+        batch = efg.BatchedExtensiveFormGame('Kuhn batch', payoff_matrices,
+                                             domains)
+        init = regret.regret_minimization_initializer(
+            matrix_regret.regret_matching_plus_initializer(), alternate=True,
+            linear_averaging=True)
+        batched = init(batch)
+        batched.iterate(50)
+        batched_x, batched_y = batched.profile()
+        epsilons = batched.epsilon()
+        values = batch.profile_value(batched_x, batched_y)
+        assert epsilons.shape == (3,)
+        for k, A in enumerate(payoff_matrices):
+            game = efg.ExtensiveFormGame(
+                'Kuhn %d' % k, A, [d._begin for d in domains],
+                [d._end for d in domains], [d._parent for d in domains])
+            algorithm = init(game)
+            algorithm.iterate(50)
+            x, y = algorithm.profile()
+            assert np.array_equal(x, batch.domain(0).unstack(batched_x)[k])
+            assert np.array_equal(y, batch.domain(1).unstack(batched_y)[k])
+            assert epsilons[k] == algorithm.epsilon()
+            assert np.isclose(values[k], algorithm.profile_value())
+
+    def test_restarted_primal_dual(self):
+        game = kuhn.init_efg(prox_scalar=1)
+        cp = chambolle_pock.ChambollePock(game)
+        pdhg = chambolle_pock.RestartedPrimalDual(game)
+        cp.iterate(500)
+        pdhg.iterate(500)
+        assert pdhg.epsilon() < 1e-6 < cp.epsilon()
+        # two utility vectors per step, plus two per restart check
+        assert pdhg.gradient_computations() >= 2 * 500 + 2 * (500 // 64)
+
+    def test_optimistic_mirror_descent(self):
+        game = kuhn.init_efg(prox_scalar=1)
+        fixed, adaptive = [
+            optimistic_mirror_descent.OptimisticMirrorDescent(
+                game, adaptive=adaptive, estimate_lipschitz=True)
+            for adaptive in [False, True]
+        ]
+        for omd in [fixed, adaptive]:
+            omd.iterate(300)
+            assert omd.gradient_computations() == 2 * 301
+        # the last iterate, without averaging; the adaptive steps grow past
+        # the fixed one while the predictions are good
+        assert adaptive.epsilon() < 0.001 < fixed.epsilon() < 0.1
+        u = adaptive._previous_utility_x
+        assert adaptive._step(0, u, u) > 2 * adaptive._eta
+
+        # a step eight times too large oscillates, unless the adaptive
+        # steps shrink it
+        fixed, adaptive = [
+            optimistic_mirror_descent.OptimisticMirrorDescent(
+                game, eta_scale=8.0, adaptive=adaptive,
+                estimate_lipschitz=True)
+            for adaptive in [False, True]
+        ]
+        fixed.iterate(300)
+        adaptive.iterate(300)
+        assert fixed.epsilon() > 0.3
+        u = adaptive._previous_utility_x
+        assert adaptive._step(0, u, u) < 0.5 * adaptive._eta
+
+    def test_mirror_prox_sampling(self):
+        mp = mirror_prox.MirrorProx(self.kuhn, aggressive_stepsizes=False,
+                                    num_samples=10, seed=0)
+        with mock.patch.object(self.kuhn, 'utility_for',
+                               side_effect=AssertionError('exact utility')):
+            mp.iterate(5)
+        # two fixed-point iterations of two utility vectors per step
+        assert mp.gradient_computations() == 5 * 2 * 2
+
+        # the aggressive step size search needs exact utilities
+        with self.assertRaises(ValueError):
+            mirror_prox.MirrorProx(self.kuhn, aggressive_stepsizes=True,
+                                   num_samples=10)
+
+    def test_checkpoint(self):
+        path = os.path.join(tempfile.mkdtemp(), 'checkpoint.npz')
+        for init in [regret.regret_minimization_initializer(
+                         matrix_regret.regret_matching_plus_initializer(),
+                         alternate=True, linear_averaging=True),
+                     regret.discounted_cfr_initializer(batched=True),
+                     chambolle_pock.ChambollePock,
+                     lambda game: chambolle_pock.RestartedPrimalDual(
+                         game, restart_check=8),
+                     optimistic_mirror_descent.optimistic_mirror_descent_init(
+                         adaptive=True)]:
+            algorithm = init(self.kuhn)
+            algorithm.iterate(40)
+            saved = init(self.kuhn)
+            saved.iterate(25)
+            saved.save_checkpoint(path, iterations=25)
+            resumed = init(self.kuhn)
+            assert resumed.load_checkpoint(path) == {'iterations': 25}
+            resumed.iterate(15)
+            x, y = algorithm.profile()
+            resumed_x, resumed_y = resumed.profile()
+            assert np.array_equal(x, resumed_x)
+            assert np.array_equal(y, resumed_y)
+            assert algorithm.gradient_computations() == \
+                resumed.gradient_computations()
+
 
 if __name__ == '__main__':
     suite = unittest.TestLoader().loadTestsFromTestCase(TestKuhn)
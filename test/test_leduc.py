@@ -1,6 +1,7 @@
 import unittest
 import numpy as np
 from poker import leduc
+from eqm import chambolle_pock
 
 class TestLeduc(unittest.TestCase):
     def setUp(self):
@@ -29,6 +30,18 @@ class TestLeduc(unittest.TestCase):
         assert abs(reach[4] - reach_diff_board * 0.5) < self.tolerance
         assert abs(reach[5] - reach_diff_board * 0.5) < self.tolerance
 
+    def test_chambolle_pock_all_one(self):
+        """ Test that CP converges with all-one prox weights when it opts
+        into the Lipschitz estimate: the moduli of strong convexity make its
+        default, the certified bound, far too loose for them
+        """
+        game = leduc.init_efg(prox_infoset_weights='all_one', prox_scalar=1)
+        certified = chambolle_pock.ChambollePock(game)
+        cp = chambolle_pock.ChambollePock(game, estimate_lipschitz=True)
+        assert certified._L > 100 * cp._L
+        cp.iterate(1000)
+        assert cp.epsilon() < 0.02
+
 
 if __name__ == '__main__':
     suite = unittest.TestLoader().loadTestsFromTestCase(TestLeduc)
@@ -0,0 +1,44 @@
+import unittest
+import numpy as np
+from matrix_game import regret
+
+
+class TestRegret(unittest.TestCase):
+    def test_cone_projection(self):
+        """ Test that the closed-form cone projection solves the same
+        equation as the root-finding reference
+        """
+        rm = regret.ConicBlackwellPlus(5)
+        np.random.seed(0)
+        for _ in range(20):
+            u_hat = np.random.randn(5)
+            u_tilde = np.random.randn()
+            y = rm.solve_for_y_tilde_sorted(u_tilde, u_hat)
+            assert np.isclose(y + np.sum(np.maximum(u_hat + y, 0)), u_tilde)
+            assert np.isclose(y, rm.solve_for_y_tilde_2(u_tilde, u_hat))
+
+    def test_segmented_cone_projection(self):
+        sizes = np.array([3, 1, 4])
+        u_hat = np.random.randn(np.sum(sizes))
+        u_tilde = np.random.randn(len(sizes))
+        y = regret.cone_projection_offset(u_tilde, u_hat, sizes)
+        rm = regret.ConicBlackwellPlus(5)
+        for i, block in enumerate(np.split(u_hat, np.cumsum(sizes)[:-1])):
+            assert y[i] == rm.solve_for_y_tilde_sorted(u_tilde[i], block)
+
+        # the reference projection cannot be batched
+        assert isinstance(rm.segmented(), regret.SegmentedConicBlackwellPlus)
+        with self.assertRaises(ValueError):
+            regret.ConicBlackwellPlus(5, reference=True).segmented()
+
+    def test_regret_discounts(self):
+        assert regret.regret_discounts(1, 1.0, 1.0) == (0.5, 0.5)
+        assert regret.regret_discounts(3, 2.0, -np.inf) == (0.9, 0.0)
+        rm = regret.DiscountedRegretMatching(2, 1.0, -np.inf)
+        rm(np.array([1.0, 0.0]))
+        assert np.array_equal(rm.regret, [0.25, 0.0])
+
+
+if __name__ == '__main__':
+    suite = unittest.TestLoader().loadTestsFromTestCase(TestRegret)
+    unittest.TextTestRunner(verbosity=2).run(suite)
@@ -51,6 +51,22 @@ class TestTreeplex(unittest.TestCase):
         pass
 
 
+    def test_index_large_treeplex(self):
+        index = self.large_treeplex.index()
+        assert np.array_equal(index.depth, [0, 1, 1, 2, 2, 2, 2, 1])
+        assert index.num_levels() == 3
+        assert np.array_equal(index.seq_to_infoset[[0, 1, 4, 7, 21]],
+                              [-1, 0, 1, 2, 7])
+        assert sorted(index.child_infosets(1)) == [1, 2]
+        assert sorted(index.child_infosets(5)) == [3, 4]
+        assert len(index.child_infosets(3)) == 0
+        for level in index.levels:
+            assert np.array_equal(index.seq_to_infoset[level.seqs],
+                                  level.infosets[level.segment])
+        assert index.seqs.dtype == np.int32
+        with self.assertRaises(ValueError):
+            index.parent[0] = 1
+
     def test_infoset_regret_small_treeplex(self):
         uniform_strat = np.full(self.small_treeplex.dimension(),
                                    0.5, dtype=float)
@@ -89,6 +105,67 @@ class TestTreeplex(unittest.TestCase):
         assert np.array_equal(expected_strat, strat)
         assert np.array_equal(expected_regrets, regrets)
 
+    def test_sequence_form_large_treeplex(self):
+        for _ in range(20):
+            y = np.random.rand(self.large_treeplex.dimension())
+            y[0] = 1
+            for i in range(self.large_treeplex.num_information_sets()):
+                begin = self.large_treeplex._begin[i]
+                end = self.large_treeplex._end[i]
+                y[begin: end] /= sum(y[begin: end])
+
+            seq = self.large_treeplex.sequence_form(y)
+            assert np.allclose(seq, sequence_form_by_traversal(self.large_treeplex, y))
+            assert np.allclose(self.large_treeplex.behavioral_form(seq), y)
+
+    def test_behavioral_form_unreached_infoset(self):
+        seq = np.array([1.0, 1.0, 0.0, 0.4, 0.6, 0.5, 0.5, 0.0, 0.0])
+        x = self.small_treeplex.behavioral_form(seq)
+        assert np.allclose(x[7:9], [0.5, 0.5])
+        assert self.small_treeplex.is_behavioral_form(x)
+
+    def test_support_small_treeplex(self):
+        utility = np.array([5.0, 1.0, 0.0, 0.0, 1.0, 1.0, 0.0, 0.0, 3.0])
+        g = utility.copy()
+        value, response = self.small_treeplex.support(g)
+        assert value == 3.0
+        assert np.array_equal(response, [1, 1, 0, 0, 1, 1, 0, 0, 1])
+        assert np.array_equal(g, utility)
+        value_only, no_response = self.small_treeplex.support(
+            g, compute_response=False)
+        assert value_only == value
+        assert no_response is None
+
+    def test_combine_sequence_form(self):
+        tp = self.large_treeplex
+        x = tp.behavioral_form(np.random.rand(tp.dimension()))
+        y = tp.behavioral_form(np.random.rand(tp.dimension()))
+        seq = tp.combine_sequence_form(tp.sequence_form(y), 0.3, x)
+        assert np.allclose(tp.behavioral_form(seq), tp.combine(y, 0.3, x))
+
+    def test_validation_levels(self):
+        not_behavioral = np.zeros(self.small_treeplex.dimension())
+        assert not self.small_treeplex.validate_behavioral_form(not_behavioral)
+        self.small_treeplex.set_validation(treeplex.VALIDATION_OFF)
+        assert self.small_treeplex.validate_behavioral_form(not_behavioral)
+        self.small_treeplex.set_validation(treeplex.VALIDATION_SAMPLED, 3)
+        checks = [self.small_treeplex.validate_behavioral_form(not_behavioral)
+                  for _ in range(6)]
+        assert checks == [True, True, False, True, True, False]
+
+    def test_gradient_small_treeplex(self):
+        y = np.array([1.0, 0.8, 0.2, 1.0, 0.0, 0.5, 0.5, 0.25, 0.75])
+        mu = 0.5
+        expected = mu * (1.0 + np.log(np.where(y > 0, y, 1.0)))
+        expected[4] = -np.inf
+        expected[0] = -mu * (1.0 - np.log(2))
+        expected[1] -= 2 * mu * (1.0 - np.log(2))
+        expected[2] -= mu * (1.0 - np.log(2))
+        gradient = self.small_treeplex.prox().gradient(y, mu)
+        assert np.array_equal(np.isinf(gradient), np.isinf(expected))
+        finite = np.isfinite(expected)
+        assert np.allclose(gradient[finite], expected[finite])
+
     def test_prox(self):
         prox_weight = 9.0
         ent = lambda x: prox_weight * (-entropy(x) + np.log(len(x)))
@@ -128,6 +205,49 @@ class TestTreeplex(unittest.TestCase):
             assert np.allclose(z, test_z)
             assert abs(val - test_val) < 1e-5
 
+        # without kroer weights the diameter is the range of the function
+        prox = self.large_treeplex.prox()
+        values = [
+            prox.distance_generating_function(self.large_treeplex.support(
+                np.random.randn(self.large_treeplex.dimension()))[1])
+            for _ in range(200)
+        ]
+        assert abs(self.large_treeplex.diameter() - max(values)) < 1e-12
+
+    def test_euclidean_prox(self):
+        domain = large_test_domain()
+        domain.set_prox(treeplex.PROX_EUCLIDEAN)
+        prox = domain.prox()
+        assert np.allclose(prox.center(), domain.center())
+        beta = 0.5
+        for _ in range(20):
+            g = np.random.randn(domain.dimension())
+            _, y = prox(1.0, np.random.randn(domain.dimension()), 0.2)
+            val, z = prox(-1.0, g, beta, y)
+            test_val, test_z = treeplex_euclidean_prox_by_projection(
+                domain, -1.0, g, beta, y)
+            assert np.allclose(z, test_z)
+            assert abs(val - test_val) < 1e-8
+            assert abs(val - (-g.dot(domain.sequence_form(z)) +
+                              beta * prox.bregman_divergence(z, y))) < 1e-8
+
+        # the diameter is the largest value of the new function, at a pure
+        # strategy
+        values = [
+            prox.distance_generating_function(
+                domain.support(np.random.randn(domain.dimension()))[1])
+            for _ in range(200)
+        ]
+        assert abs(domain.diameter() - max(values)) < 1e-12
+
+
+def sequence_form_by_traversal(tp, x):
+    seq = np.copy(x)
+    for i in range(tp.num_information_sets()):
+        begin = tp._begin[i]
+        end = tp._end[i]
+        seq[begin: end] *= seq[tp._parent[i]]
+    return seq
 
 
 def treeplex_prox_by_simplex_prox(tp, alpha, g, beta, y=None):
@@ -150,6 +270,32 @@ def treeplex_prox_by_simplex_prox(tp, alpha, g, beta, y=None):
 
     return g[0], z
 
+
+def simplex_projection(v):
+    u = np.sort(v)[::-1]
+    cumulative = np.cumsum(u)
+    rho = max(k for k in range(1, len(u) + 1)
+              if u[k - 1] > (cumulative[k - 1] - 1) / k)
+    return np.maximum(v - (cumulative[rho - 1] - 1) / rho, 0)
+
+
+def treeplex_euclidean_prox_by_projection(tp, alpha, g, beta, y):
+    """The dilated Euclidean prox, one information set at a time: locally
+    argmin_p g_j'p + w*||p - y_j||^2/2 = projection of y_j - g_j/w."""
+    z = np.zeros(tp.dimension())
+    z[0] = 1.0
+    g = alpha * g
+    for i in tp.infoset_traversal():
+        begin = tp._begin[i]
+        end = tp._end[i]
+        dgf_weight = beta * tp.prox()._weights[i]
+        p = simplex_projection(y[begin: end] - g[begin: end] / dgf_weight)
+        z[begin: end] = p
+        g[tp._parent[i]] += g[begin: end].dot(p) + \
+            dgf_weight * 0.5 * np.sum((p - y[begin: end])**2)
+    return g[0], z
+
+
 if __name__ == '__main__':
     suite = unittest.TestLoader().loadTestsFromTestCase(TestTreeplex)
     unittest.TextTestRunner(verbosity=2).run(suite)